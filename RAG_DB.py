@@ -1,33 +1,83 @@
+import heapq
 import sqlite3
+import threading
+import numpy as np
+from collections import namedtuple
 from datetime import datetime
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Iterator, Callable, Union, Sequence
 from functools import lru_cache
+from vectors import normalize_text, embed_text, to_blob, from_blob
+from tokenizer import TOKENIZER_VERSION, term_set, tag_terms, query_terms
+
+RESOURCE_COLUMNS = 'id, name, description, content, created_at, tags'
+CONVERSATION_COLUMNS = 'id, user_input, assistant_response, created_at'
+
+# Columns the iteration API may project, per table
+TABLE_FIELDS = {
+    'resources': ('id', 'name', 'description', 'content', 'created_at', 'tags', 'source', 'last_accessed', 'hit_count'),
+    'conversations': ('id', 'user_input', 'assistant_response', 'created_at', 'normalized_input', 'input_vector'),
+}
+
+# Rows fetched per round trip by the streaming iterators
+ITER_BATCH_SIZE = 256
+
+# Term weight per resource field in the inverted index, a term keeps its best field
+FIELD_WEIGHTS = (('name', 4), ('description', 3), ('tags', 2), ('content', 1))
+
+
+def fetch_batches(cursor, batch_size: int = ITER_BATCH_SIZE) -> Iterator[list]:
+    """Yields the rows of an executed cursor `batch_size` at a time."""
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield rows
+
+
+@lru_cache(maxsize=64)
+def _row_class(fields: tuple):
+    return namedtuple('Row', fields)
+
+
+def namedtuple_row(cursor, row: tuple):
+    """sqlite3 row factory returning namedtuples: as small as plain tuples, but fields are read by name."""
+    return _row_class(tuple(d[0] for d in cursor.description))(*row)
+
 
 class RAGDB:
+    # Background compaction threads, one per database file
+    _compaction_jobs = {}
+    _compaction_lock = threading.Lock()
+
     def __init__(self, db_path: str = "ragV2.db"):
         self.db_path = db_path
         self._create_tables()
+        self._backfill_conversation_vectors()
+        self._backfill_resource_tokens()
         # self.migrateV1()
         self.new_resources = []
         self.new_conversations = []
 
     def migrateV1(self):
         try:
-            # load the old database rag.db
-            with sqlite3.connect("rag.db") as conn:
+            # load the old database rag.db, streamed so the old tables never sit in memory at once
+            conn = sqlite3.connect("rag.db")
+            try:
                 cursor = conn.cursor()
-                cursor.execute('SELECT * FROM resources')
-                resources = cursor.fetchall()
-                cursor.execute('SELECT * FROM conversations')
-                conversations = cursor.fetchall()
-            
-            # migrate the resources
-            for resource in resources:
-                self.add_resource(resource[1], resource[2], resource[3], "")
-            
-            # migrate the conversations
-            for conversation in conversations:
-                self.add_conversation(conversation[1], conversation[2])
+
+                # migrate the resources
+                cursor.execute('SELECT * FROM resources ORDER BY id')
+                for batch in fetch_batches(cursor):
+                    for resource in batch:
+                        self.add_resource(resource[1], resource[2], resource[3], "")
+
+                # migrate the conversations
+                cursor.execute('SELECT * FROM conversations ORDER BY id')
+                for batch in fetch_batches(cursor):
+                    for conversation in batch:
+                        self.add_conversation(conversation[1], conversation[2])
+            finally:
+                conn.close()
         except Exception as e:
             print(f"Error migrating database: {str(e)}")
 
@@ -35,6 +85,10 @@ class RAGDB:
     def _create_tables(self):
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
+
+            # Streaming readers hold a read transaction while they iterate, in WAL mode
+            # writers (tag backfill, ingestion) can still commit alongside them
+            cursor.execute('PRAGMA journal_mode = WAL')
             
             # Create Resources table
             cursor.execute('''
@@ -58,20 +112,185 @@ class RAGDB:
                 )
             ''')
 
-    def add_resource(self, name: str, content: str, description: str , tags : str) -> int:
+            # Columns used by the answer cache, added in place on older databases
+            self._ensure_columns(cursor, 'conversations', {
+                'normalized_input': 'TEXT',
+                'input_vector': 'BLOB'
+            })
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_normalized_input ON conversations (normalized_input)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_conversations_created_at ON conversations (created_at)')
+
+            # Retention metadata: where a resource came from and how often search returns it
+            self._ensure_columns(cursor, 'resources', {
+                'source': "TEXT DEFAULT 'manual'",
+                'last_accessed': 'TIMESTAMP',
+                'hit_count': 'INTEGER DEFAULT 0'
+            })
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_resources_source_usage ON resources (source, hit_count, last_accessed)')
+
+            # Per-resource token cache written at ingest, read by the term scorer
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS resource_tokens (
+                    resource_id INTEGER PRIMARY KEY,
+                    name_terms TEXT NOT NULL,
+                    description_terms TEXT NOT NULL,
+                    tag_terms TEXT NOT NULL,
+                    content_terms TEXT NOT NULL
+                )
+            ''')
+
+            # Inverted index over the same terms, the multi-query scorer joins query terms on it
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'resource_terms'")
+            if cursor.fetchone() is None:
+                cursor.execute('''
+                    CREATE TABLE resource_terms (
+                        term TEXT NOT NULL,
+                        resource_id INTEGER NOT NULL,
+                        weight INTEGER NOT NULL,
+                        PRIMARY KEY (term, resource_id)
+                    ) WITHOUT ROWID
+                ''')
+                cursor.execute('CREATE INDEX idx_resource_terms_resource ON resource_terms (resource_id)')
+                # Rebuilt together with the token cache by the backfill
+                cursor.execute('DELETE FROM resource_tokens')
+
+            cursor.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._check_tokenizer_version(cursor)
+
+            self.has_fts = self._create_conversations_fts(cursor)
+
+    def _check_tokenizer_version(self, cursor) -> None:
+        # Tokens and vectors from another tokenizer version are dropped, the backfills rebuild them
+        cursor.execute("SELECT value FROM meta WHERE key = 'tokenizer_version'")
+        row = cursor.fetchone()
+        if row is not None and row[0] == str(TOKENIZER_VERSION):
+            return
+        cursor.execute('UPDATE conversations SET normalized_input = NULL, input_vector = NULL')
+        cursor.execute('DELETE FROM resource_tokens')
+        cursor.execute('DELETE FROM resource_terms')
+        cursor.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('tokenizer_version', ?)",
+            (str(TOKENIZER_VERSION),)
+        )
+
+    def _create_conversations_fts(self, cursor) -> bool:
+        """
+        Full-text index over past conversations, kept in sync by triggers.
+        Returns False when the SQLite build has no FTS5, search then falls back to vectors only.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations_fts'")
+        exists = cursor.fetchone() is not None
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS conversations_fts USING fts5(
+                    user_input, assistant_response, content='conversations', content_rowid='id'
+                )
+            ''')
+        except sqlite3.OperationalError:
+            return False
+
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+                INSERT INTO conversations_fts (rowid, user_input, assistant_response)
+                VALUES (new.id, new.user_input, new.assistant_response);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+                INSERT INTO conversations_fts (conversations_fts, rowid, user_input, assistant_response)
+                VALUES ('delete', old.id, old.user_input, old.assistant_response);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF user_input, assistant_response ON conversations BEGIN
+                INSERT INTO conversations_fts (conversations_fts, rowid, user_input, assistant_response)
+                VALUES ('delete', old.id, old.user_input, old.assistant_response);
+                INSERT INTO conversations_fts (rowid, user_input, assistant_response)
+                VALUES (new.id, new.user_input, new.assistant_response);
+            END
+        ''')
+
+        # Index the conversations that were stored before the FTS table existed
+        if not exists:
+            cursor.execute("INSERT INTO conversations_fts (conversations_fts) VALUES ('rebuild')")
+        return True
+
+    def _ensure_columns(self, cursor, table: str, columns: dict) -> None:
+        cursor.execute(f'PRAGMA table_info({table})')
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, col_type in columns.items():
+            if name not in existing:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {col_type}')
+
+    def _backfill_conversation_vectors(self, batch_size: int = ITER_BATCH_SIZE) -> None:
+        # One batch at a time: filled rows drop out of the WHERE clause, so the loop ends when none are left
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            while True:
+                cursor.execute('SELECT id, user_input FROM conversations WHERE normalized_input IS NULL LIMIT ?', (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                cursor.executemany(
+                    'UPDATE conversations SET normalized_input = ?, input_vector = ? WHERE id = ?',
+                    [(normalize_text(text), to_blob(embed_text(text)), cid) for cid, text in rows]
+                )
+
+    def _write_tokens(self, cursor, resource_id: int, name: str, description: str, tags: str, content: str) -> None:
+        """Replaces the token cache row and the inverted index entries of one resource."""
+        fields = (term_set(name), term_set(description or ''), tag_terms(tags or ''), term_set(content or ''))
+        cursor.execute(
+            'INSERT OR REPLACE INTO resource_tokens VALUES (?, ?, ?, ?, ?)',
+            (resource_id, *(" ".join(sorted(terms)) for terms in fields))
+        )
+        weights = {}
+        for (_, weight), terms in zip(FIELD_WEIGHTS, fields):
+            for term in terms:
+                weights[term] = max(weights.get(term, 0), weight)
+        cursor.execute('DELETE FROM resource_terms WHERE resource_id = ?', (resource_id,))
+        cursor.executemany(
+            'INSERT INTO resource_terms (term, resource_id, weight) VALUES (?, ?, ?)',
+            [(term, resource_id, weight) for term, weight in weights.items()]
+        )
+
+    def _refresh_tokens(self, cursor, resource_id: int) -> None:
+        cursor.execute('SELECT id, name, description, tags, content FROM resources WHERE id = ?', (resource_id,))
+        row = cursor.fetchone()
+        if row is not None:
+            self._write_tokens(cursor, *row)
+
+    def _backfill_resource_tokens(self, batch_size: int = ITER_BATCH_SIZE) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            while True:
+                cursor.execute('''
+                    SELECT r.id, r.name, r.description, r.tags, r.content FROM resources r
+                    LEFT JOIN resource_tokens t ON t.resource_id = r.id
+                    WHERE t.resource_id IS NULL
+                    LIMIT ?
+                ''', (batch_size,))
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    self._write_tokens(cursor, *row)
+
+    def add_resource(self, name: str, content: str, description: str , tags : str, source: str = "manual") -> int:
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             cursor.execute(
-                'INSERT INTO resources (name, description, content, tags) VALUES (?, ?, ?, ?)',
-                (name, description, content, tags)
+                'INSERT INTO resources (name, description, content, tags, source) VALUES (?, ?, ?, ?, ?)',
+                (name, description, content, tags, source)
             )
+            resource_id = cursor.lastrowid
+            self._write_tokens(cursor, resource_id, name, description, tags, content)
             self.new_resources.append({
                 "name": name,
                 "content": content,
                 "description": description,
                 "tags": tags
             })
-            return cursor.lastrowid
+            return resource_id
         
     def update_tags(self, resource_id: int, tags: str) -> None:
         with sqlite3.connect(self.db_path) as conn:
@@ -80,20 +299,28 @@ class RAGDB:
                 'UPDATE resources SET tags = ? WHERE id = ?',
                 (tags, resource_id)
             )
+            self._refresh_tokens(cursor, resource_id)
     
-    def resources_with_empty_tags(self) -> List[Tuple]:
+    def update_enrichment(self, resource_id: int, description: str, tags: str) -> None:
+        """Sets the tags, and the description only where the resource has none yet."""
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM resources WHERE tags IS NULL OR tags = ""')
-            return cursor.fetchall()
+            cursor.execute(
+                "UPDATE resources SET tags = ?, description = COALESCE(NULLIF(description, ''), ?) WHERE id = ?",
+                (tags, description, resource_id)
+            )
+            self._refresh_tokens(cursor, resource_id)
+
+    def resources_with_empty_tags(self) -> List[Tuple]:
+        return list(self.iter_resources(where="tags IS NULL OR tags = ''"))
         
 
     def add_conversation(self, user_input: str, assistant_response: str) -> int:
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             cursor.execute(
-                'INSERT INTO conversations (user_input, assistant_response) VALUES (?, ?)',
-                (user_input, assistant_response)
+                'INSERT INTO conversations (user_input, assistant_response, normalized_input, input_vector) VALUES (?, ?, ?, ?)',
+                (user_input, assistant_response, normalize_text(user_input), to_blob(embed_text(user_input)))
             )
             self.new_conversations.append({
                 "user_input": user_input,
@@ -101,109 +328,459 @@ class RAGDB:
             })
             return cursor.lastrowid
 
+    def find_cached_answer(self, user_input: str, threshold: float = 0.92, max_age_hours: Optional[float] = None) -> Optional[dict]:
+        """
+        Looks for a past conversation that answers the same question.
+
+        An identical normalised input is an exact hit. Otherwise the stored input
+        vectors are compared with the new one and the most similar conversation is
+        returned if its cosine similarity reaches `threshold`. Only conversations
+        younger than `max_age_hours` are considered when it is set.
+        """
+        normalized = normalize_text(user_input)
+        if not normalized:
+            return None
+
+        age_filter = ''
+        age_params = []
+        if max_age_hours is not None:
+            age_filter = 'AND created_at >= datetime(\'now\', ?)'
+            age_params = [f'-{float(max_age_hours)} hours']
+
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, user_input, assistant_response, created_at FROM conversations
+                WHERE normalized_input = ? {age_filter}
+                ORDER BY id DESC LIMIT 1
+            ''', [normalized] + age_params)
+            row = cursor.fetchone()
+            if row:
+                return {
+                    'id': row[0],
+                    'user_input': row[1],
+                    'assistant_response': row[2],
+                    'created_at': row[3],
+                    'similarity': 1.0,
+                    'match': 'exact'
+                }
+
+            matches = self._top_vector_matches(cursor, embed_text(user_input), 1, age_filter, age_params)
+            if not matches or matches[0][0] < threshold:
+                return None
+            similarity, best_id = matches[0]
+
+            cursor.execute(
+                'SELECT id, user_input, assistant_response, created_at FROM conversations WHERE id = ?',
+                (best_id,)
+            )
+            row = cursor.fetchone()
+            return {
+                'id': row[0],
+                'user_input': row[1],
+                'assistant_response': row[2],
+                'created_at': row[3],
+                'similarity': similarity,
+                'match': 'semantic'
+            }
+
+    def search_conversations(self, query: str, k: int = 8, token_budget: int = 1500, rrf_k: int = 60, min_similarity: float = 0.3) -> list:
+        """
+        Finds the past conversations most relevant to `query` across the whole history.
+
+        Full-text (bm25) and input-vector rankings are fused with reciprocal rank fusion,
+        vector matches below `min_similarity` are ignored as hash noise.
+        Conversations are taken in fused order until `k` turns or `token_budget`
+        (estimated as characters / 4) is reached, and returned oldest first.
+        """
+        terms = normalize_text(query).split()
+        if not terms:
+            return []
+        candidates = k * 4
+        ranks = {}
+
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+
+            if self.has_fts:
+                match = " OR ".join(f'"{t}"' for t in dict.fromkeys(terms))
+                cursor.execute(
+                    'SELECT rowid FROM conversations_fts WHERE conversations_fts MATCH ? ORDER BY bm25(conversations_fts) LIMIT ?',
+                    (match, candidates)
+                )
+                for rank, (cid,) in enumerate(cursor.fetchall(), start=1):
+                    ranks[cid] = ranks.get(cid, 0.0) + 1.0 / (rrf_k + rank)
+
+            matches = self._top_vector_matches(cursor, embed_text(query), candidates)
+            for rank, (similarity, cid) in enumerate(matches, start=1):
+                if similarity < min_similarity:
+                    break
+                ranks[cid] = ranks.get(cid, 0.0) + 1.0 / (rrf_k + rank)
+
+            selected = []
+            used_tokens = 0
+            for cid, score in sorted(ranks.items(), key=lambda x: -x[1]):
+                if len(selected) >= k:
+                    break
+                cursor.execute(
+                    'SELECT id, user_input, assistant_response, created_at FROM conversations WHERE id = ?',
+                    (cid,)
+                )
+                row = cursor.fetchone()
+                tokens = (len(row[1]) + len(row[2])) // 4
+                if used_tokens + tokens > token_budget:
+                    continue
+                used_tokens += tokens
+                selected.append({
+                    'id': row[0],
+                    'user_input': row[1],
+                    'assistant_response': row[2],
+                    'created_at': row[3],
+                    'score': score
+                })
+
+        return sorted(selected, key=lambda x: (x['created_at'], x['id']))
+
+    def _top_vector_matches(self, cursor, query_vector: np.ndarray, k: int, where: str = '', params: Sequence = ()) -> List[Tuple[float, int]]:
+        """
+        Streams the stored input vectors batch by batch and keeps the `k` most similar
+        to `query_vector` as (similarity, id), best first. `where` is appended to the
+        filter, e.g. 'AND created_at >= ?'.
+        """
+        cursor.execute(f'SELECT id, input_vector FROM conversations WHERE input_vector IS NOT NULL {where}', list(params))
+        best = []
+        for rows in fetch_batches(cursor):
+            similarities = np.vstack([from_blob(blob) for _, blob in rows]) @ query_vector
+            best = heapq.nlargest(k, best + list(zip(similarities.tolist(), (row[0] for row in rows))), key=lambda x: x[0])
+        return best
+
+    def touch_resources(self, resource_ids) -> None:
+        with sqlite3.connect(self.db_path) as conn:
+            self._touch_resources(conn.cursor(), resource_ids)
+
+    def _touch_resources(self, cursor, resource_ids) -> None:
+        # Usage stats for the retention policy, least used web resources are evicted first
+        cursor.executemany(
+            'UPDATE resources SET hit_count = COALESCE(hit_count, 0) + 1, last_accessed = CURRENT_TIMESTAMP WHERE id = ?',
+            [(rid,) for rid in resource_ids]
+        )
+
+    def _delete_resources(self, cursor, resource_ids: List[int]) -> None:
+        # Single place to drop resources so derived data can be removed alongside
+        cursor.executemany('DELETE FROM resources WHERE id = ?', [(rid,) for rid in resource_ids])
+        cursor.executemany('DELETE FROM resource_tokens WHERE resource_id = ?', [(rid,) for rid in resource_ids])
+        cursor.executemany('DELETE FROM resource_terms WHERE resource_id = ?', [(rid,) for rid in resource_ids])
+
+    def compact(self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None, web_ttl_days: Optional[float] = None) -> dict:
+        """
+        Enforces the retention policy on web resources and reclaims the freed space.
+
+        - Web resources not accessed (or created) within `web_ttl_days` are removed.
+        - If the table still holds more than `max_rows` rows or `max_bytes` of text, the
+          least used web resources (fewest hits, oldest access) go first.
+        - Manually added resources are never evicted, even if that leaves the limits exceeded.
+
+        Returns the number of evicted rows per rule.
+        """
+        evicted = {"ttl": 0, "max_rows": 0, "max_bytes": 0}
+        size_sql = 'LENGTH(CAST(content AS BLOB)) + COALESCE(LENGTH(CAST(description AS BLOB)), 0) + LENGTH(CAST(name AS BLOB))'
+
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+
+            if web_ttl_days is not None:
+                cursor.execute(
+                    "SELECT id FROM resources WHERE source = 'web' AND COALESCE(last_accessed, created_at) < datetime('now', ?)",
+                    (f'-{float(web_ttl_days)} days',)
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+                self._delete_resources(cursor, ids)
+                evicted["ttl"] = len(ids)
+
+            eviction_order = "FROM resources WHERE source = 'web' ORDER BY COALESCE(hit_count, 0) ASC, COALESCE(last_accessed, created_at) ASC"
+
+            if max_rows is not None:
+                cursor.execute('SELECT COUNT(*) FROM resources')
+                excess = cursor.fetchone()[0] - max_rows
+                if excess > 0:
+                    cursor.execute(f'SELECT id {eviction_order} LIMIT ?', (excess,))
+                    ids = [row[0] for row in cursor.fetchall()]
+                    self._delete_resources(cursor, ids)
+                    evicted["max_rows"] = len(ids)
+
+            if max_bytes is not None:
+                cursor.execute(f'SELECT COALESCE(SUM({size_sql}), 0) FROM resources')
+                excess = cursor.fetchone()[0] - max_bytes
+                if excess > 0:
+                    cursor.execute(f'SELECT id, {size_sql} {eviction_order}')
+                    ids = []
+                    while excess > 0:
+                        row = cursor.fetchone()
+                        if row is None:
+                            break
+                        ids.append(row[0])
+                        excess -= row[1]
+                    self._delete_resources(cursor, ids)
+                    evicted["max_bytes"] = len(ids)
+
+            cursor.execute('PRAGMA optimize')
+
+        self._vacuum()
+        return evicted
+
+    def _vacuum(self) -> None:
+        # Switching to incremental auto_vacuum needs one full VACUUM, after that freed pages are returned cheaply
+        conn = sqlite3.connect(self.db_path, isolation_level=None)
+        try:
+            mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+            if mode != 2:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+            else:
+                # The pragma frees one page per step, executescript runs it to completion
+                conn.executescript('PRAGMA incremental_vacuum;')
+        finally:
+            conn.close()
+
+    def start_compaction(self, interval_seconds: float = 3600, **policy) -> None:
+        """Runs `compact(**policy)` every `interval_seconds` on a daemon thread, once per database file."""
+        with RAGDB._compaction_lock:
+            job = RAGDB._compaction_jobs.get(self.db_path)
+            if job and job[0].is_alive():
+                return
+            stop = threading.Event()
+
+            def run():
+                while not stop.wait(interval_seconds):
+                    try:
+                        print(f"Compaction of {self.db_path}: {self.compact(**policy)}")
+                    except Exception as e:
+                        print(f"Compaction error: {str(e)}")
+
+            thread = threading.Thread(target=run, name=f"compaction-{self.db_path}", daemon=True)
+            RAGDB._compaction_jobs[self.db_path] = (thread, stop)
+            thread.start()
+
+    def stop_compaction(self) -> None:
+        with RAGDB._compaction_lock:
+            job = RAGDB._compaction_jobs.pop(self.db_path, None)
+        if job:
+            job[1].set()
+
     def get_resource(self, resource_id: int) -> Optional[Tuple]:
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM resources WHERE id = ?', (resource_id,))
+            cursor.execute(f'SELECT {RESOURCE_COLUMNS} FROM resources WHERE id = ?', (resource_id,))
             return cursor.fetchone()
 
     def get_conversation(self, conversation_id: int) -> Optional[Tuple]:
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM conversations WHERE id = ?', (conversation_id,))
+            cursor.execute('SELECT id, user_input, assistant_response, created_at FROM conversations WHERE id = ?', (conversation_id,))
             return cursor.fetchone()
 
     def get_all_resources(self) -> List[Tuple]:
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute('SELECT * FROM resources')
-            return cursor.fetchall()
+        # Loads every row, prefer iter_resources for anything that can stream
+        return list(self.iter_resources())
 
     def get_all_conversations(self) -> List[Tuple]:
+        return list(self.iter_conversations())
+
+    def _projection(self, table: str, columns: Union[str, Sequence[str], None]) -> str:
+        fields = TABLE_FIELDS.get(table)
+        if fields is None:
+            raise ValueError(f"Unknown table: {table}")
+        if columns is None:
+            return ', '.join(fields)
+        if isinstance(columns, str):
+            columns = columns.split(',')
+        columns = [c.strip() for c in columns]
+        unknown = [c for c in columns if c not in fields]
+        if unknown:
+            raise ValueError(f"Unknown {table} columns: {', '.join(unknown)}")
+        return ', '.join(columns)
+
+    def iter_batches(self, table: str, columns: Union[str, Sequence[str], None] = None, where: Optional[str] = None, params: Sequence = (),
+                     batch_size: int = ITER_BATCH_SIZE, row_factory: Optional[Callable] = None,
+                     limit: Optional[int] = None, offset: int = 0) -> Iterator[list]:
+        """
+        Streams the rows of `table` in id order as lists of at most `batch_size` rows.
+
+        Only the requested `columns` are read, `where` is an SQL condition with `params`
+        bound to its placeholders. `row_factory` is a sqlite3 row factory such as
+        `namedtuple_row` or `sqlite3.Row`, rows are plain tuples by default. The
+        connection stays open until the generator is exhausted or closed.
+        """
+        sql = f'SELECT {self._projection(table, columns)} FROM {table}'
+        params = list(params)
+        if where:
+            sql += f' WHERE {where}'
+        sql += ' ORDER BY id'
+        if limit is not None or offset:
+            sql += ' LIMIT ? OFFSET ?'
+            params += [-1 if limit is None else limit, offset]
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            if row_factory is not None:
+                conn.row_factory = row_factory
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            yield from fetch_batches(cursor, batch_size)
+        finally:
+            conn.close()
+
+    def iter_resources(self, columns: Union[str, Sequence[str]] = RESOURCE_COLUMNS, where: Optional[str] = None, params: Sequence = (), **kwargs) -> Iterator:
+        """Streams resources one row at a time, see `iter_batches` for the arguments."""
+        for batch in self.iter_batches('resources', columns, where, params, **kwargs):
+            yield from batch
+
+    def iter_conversations(self, columns: Union[str, Sequence[str]] = CONVERSATION_COLUMNS, where: Optional[str] = None, params: Sequence = (), **kwargs) -> Iterator:
+        """Streams conversations one row at a time, see `iter_batches` for the arguments."""
+        for batch in self.iter_batches('conversations', columns, where, params, **kwargs):
+            yield from batch
+
+    def count_rows(self, table: str, where: Optional[str] = None, params: Sequence = ()) -> int:
+        if table not in TABLE_FIELDS:
+            raise ValueError(f"Unknown table: {table}")
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM conversations')
-            return cursor.fetchall()
+            cursor.execute(f'SELECT COUNT(*) FROM {table}' + (f' WHERE {where}' if where else ''), list(params))
+            return cursor.fetchone()[0]
         
     def get_last_n_conversations(self, n: int) -> List[Tuple]:
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM conversations ORDER BY created_at DESC LIMIT ?', (n,))
+            cursor.execute('SELECT id, user_input, assistant_response, created_at FROM conversations ORDER BY created_at DESC LIMIT ?', (n,))
             return cursor.fetchall()
         
 
-    @lru_cache(maxsize=8196)
     def search_resources(self, query: str, n_results: int = 8) -> list:  # Updated return type
+        return [
+            {
+                'name': r['name'],
+                'description': r['description'],
+                'content': r['content'],
+                'tags': r['tags'],
+                'relevance': r['relevance']
+            }
+            for r in self.search_resources_multi([query], n_results, n_results)
+        ]
+
+    def search_resources_multi(self, queries: List[str], n_results: int = 8, per_query: int = 8, rrf_k: int = 60, touch: bool = True) -> list:
+        """
+        Runs several term searches in a single statement and fuses their rankings
+        with reciprocal rank fusion (score = sum of 1 / (rrf_k + rank)).
+
+        Query terms come from the tokenizer and are matched against the inverted index
+        written at ingest. A sub-query's relevance for a resource is the summed field
+        weight of its terms (4 = name, 3 = description, 2 = tags, 1 = content) divided
+        by its number of terms, so 4 means every term is in the name.
+
+        Returns up to `n_results` deduplicated resources ordered by fused score. Each
+        result carries a `queries` list with the sub-queries that matched it and the
+        rank and relevance it had in each of them. With `touch` off the usage stats are
+        left alone, for callers that re-rank and touch the final results themselves.
+        """
+        # Sub-queries with the same terms are searched once, ones with only stopwords not at all
+        terms = []
+        seen = set()
+        for q in queries:
+            q = (q or '').strip()
+            key = query_terms(q)
+            if key and key not in seen:
+                seen.add(key)
+                terms.append(q)
+        if not terms:
+            return []
+
+        pairs = [(i, term) for i, q in enumerate(terms) for term in sorted(query_terms(q))]
+        values = ", ".join("(?, ?)" for _ in pairs)
+        params = [p for pair in pairs for p in pair]
+
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
-            cursor.execute('''
-                SELECT *, 
-                    (CASE 
-                        WHEN name LIKE ? THEN 4
-                        WHEN description LIKE ? THEN 3 
-                        WHEN tags LIKE ? THEN 2
-                        WHEN content LIKE ? THEN 1
-                        ELSE 0
-                    END) as relevance
-                FROM resources 
-                WHERE name LIKE ? 
-                OR description LIKE ? 
-                OR content LIKE ? 
-                OR tags LIKE ?
-                ORDER BY relevance DESC
-                LIMIT ?
-            ''', (
-                f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%',
-                f'%{query}%', f'%{query}%', f'%{query}%', f'%{query}%',
-                n_results
-            ))
-            
-            results = cursor.fetchall()
-            return [
-                {
-                    'name': row[1],
-                    'description': row[2],
-                    'content': row[3],
-                    'tags': row[5],
-                    'relevance': row[-1]  # Added relevance score
+            cursor.execute(f'''
+                WITH q(qi, term) AS (VALUES {values}),
+                sizes AS (
+                    SELECT qi, COUNT(*) as n_terms FROM q GROUP BY qi
+                ),
+                scored AS (
+                    SELECT q.qi, t.resource_id as id,
+                        CAST(SUM(t.weight) AS REAL) / sizes.n_terms as relevance
+                    FROM q
+                    JOIN resource_terms t ON t.term = q.term
+                    JOIN sizes ON sizes.qi = q.qi
+                    GROUP BY q.qi, t.resource_id
+                ),
+                ranked AS (
+                    SELECT qi, id, relevance,
+                        ROW_NUMBER() OVER (PARTITION BY qi ORDER BY relevance DESC, id) as rnk
+                    FROM scored
+                )
+                SELECT ranked.qi, ranked.rnk, ranked.relevance,
+                    r.id, r.name, r.description, r.content, r.tags
+                FROM ranked JOIN resources r ON r.id = ranked.id
+                WHERE ranked.rnk <= ?
+            ''', params + [per_query])
+            rows = cursor.fetchall()
+
+        fused = {}
+        for qi, rank, relevance, rid, name, description, content, tags in rows:
+            entry = fused.get(rid)
+            if entry is None:
+                entry = fused[rid] = {
+                    'id': rid,
+                    'name': name,
+                    'description': description,
+                    'content': content,
+                    'tags': tags,
+                    'relevance': relevance,
+                    'rrf_score': 0.0,
+                    'queries': []
                 }
-                for row in results
-            ]
-    
-    @lru_cache(maxsize=4096)
+            entry['rrf_score'] += 1.0 / (rrf_k + rank)
+            entry['relevance'] = max(entry['relevance'], relevance)
+            entry['queries'].append({'query': terms[qi], 'rank': rank, 'relevance': relevance})
+
+        fused = sorted(fused.values(), key=lambda x: (-x['rrf_score'], x['id']))[:n_results]
+        # Only the resources handed back count as used, not every per-query candidate
+        if touch:
+            self.touch_resources([r['id'] for r in fused])
+        return fused
+
     def _search_resources_new(self, query: str, n_results: int = 3, content_length : int = 2048) -> list:
         try:
-            # Tokenize and clean query
-            query_terms = set(word.lower() for word in query.split())
-            
-            # Get resources from SQLite DB
+            # Query terms are normalised once and cached, resource terms come from the token cache
+            terms = query_terms(query)
+            if not terms:
+                return []
+
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute('SELECT name, content, tags, description FROM resources')
-                resources = cursor.fetchall()
-            
-            res_list = []
-            for name, content, tags, description in resources:
-                # Calculate relevance scores
-                content_terms = set(word.lower() for word in content.split())
-                name_terms = set(word.lower() for word in name.split())
-                tag_terms = set(word.lower() for word in (tags or '').split(','))
-                description_terms = set(word.lower() for word in (description or '').split())
-                
-                # Weighted scoring
-                name_matches = len(query_terms & name_terms) * 2.5  # Higher weight for name
-                content_matches = len(query_terms & content_terms)
-                tag_matches = len(query_terms & tag_terms) * 2.0    # Medium weight for tags
-                description_matches = len(query_terms & description_terms) * 2.0   # Medium weight for description
-                
-                total_score = name_matches + content_matches + tag_matches + description_matches
-                
-                # Include if matches found
-                if total_score > 0:
+                cursor.execute('SELECT resource_id, name_terms, description_terms, tag_terms, content_terms FROM resource_tokens')
+                scores = []
+                for rid, name_terms, description_terms, resource_tag_terms, content_terms in cursor:
+                    # Weighted scoring: name highest, tags and description medium, content lowest
+                    total_score = (
+                        len(terms.intersection(name_terms.split())) * 2.5
+                        + len(terms.intersection(content_terms.split()))
+                        + len(terms.intersection(resource_tag_terms.split())) * 2.0
+                        + len(terms.intersection(description_terms.split())) * 2.0
+                    )
+                    if total_score > 0:
+                        scores.append((total_score, rid))
+
+                # Sort by score and limit results, only the winners are read from resources
+                scores = sorted(scores, key=lambda x: (-x[0], x[1]))[:n_results]
+                res_list = []
+                for total_score, rid in scores:
+                    cursor.execute('SELECT name, content, tags, description FROM resources WHERE id = ?', (rid,))
+                    name, content, tags, description = cursor.fetchone()
                     # Limit content length for display
                     display_content = content[:content_length] + '...' if len(content) > content_length else content
-                    
                     res_list.append({
+                        'id': rid,
                         'name': name,
                         'content': display_content,
                         'score': total_score,
@@ -211,17 +788,8 @@ class RAGDB:
                         'description': description or ''
                     })
 
-            # Sort by score and limit results
-            res_list = sorted(res_list, key=lambda x: float(x['score']), reverse=True)[:n_results]
+                self._touch_resources(cursor, [r['id'] for r in res_list])
 
-            # Format results with metadata
-            # context = "\n\n".join([
-            #     f"Source: {r['name']} (Score: {r['score']:.1f})\n"
-            #     f"Tags: {r['tags']}\n"
-            #     f"Content: {r['content']}" 
-            #     for r in res_list
-            # ])
-            
             return res_list
 
         except Exception as e:
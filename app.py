@@ -1,7 +1,11 @@
 import streamlit as st
 import pandas as pd
+from profiling import profiling_enabled
 from main import OllamaRAG, CODDER_MODEL, DEEP_SEEK_MODEL, CODDER_MODEL_BIG, CODDER_MODEL_SMALL, DEEP_SEEK_MODEL_BIG, DEEP_SEEK_MODEL_NORMAL, DEEP_SEEK_MODEL_NORMAL_V2
 
+# Rows per page on the Resources and Conversation History pages
+PAGE_SIZE = 200
+
 # Page configuration
 st.set_page_config(
     page_title="RAG Chat System",
@@ -22,8 +26,16 @@ if "context_search" not in st.session_state:
     st.session_state.context_search = True
 if "deep_search" not in st.session_state:
     st.session_state.deep_search = False
+if "adaptive_web_search" not in st.session_state:
+    st.session_state.adaptive_web_search = False
 if "number_of_resources" not in st.session_state:
     st.session_state.number_of_resources = 5
+if "profile" not in st.session_state:
+    st.session_state.profile = profiling_enabled()
+if "ollama_context" not in st.session_state:
+    st.session_state.ollama_context = None
+if "loaded_model" not in st.session_state:
+    st.session_state.loaded_model = None
 
 # Sidebar for model selection
 with st.sidebar:
@@ -54,6 +66,12 @@ with st.sidebar:
             help="Enable or disable deep search for more accurate responses."
         )
 
+        st.session_state.adaptive_web_search = st.selectbox(
+            "Adaptive Web Search", 
+            [False, True], 
+            help="Skip the web search when the local database already has relevant resources."
+        )
+
     
     st.session_state.performance_mode = st.selectbox(
         "Performance Mode", 
@@ -67,6 +85,12 @@ with st.sidebar:
         help="Enable or disable context search for better responses."
     )
 
+    st.session_state.profile = st.toggle(
+        "Profile Turns", 
+        value=st.session_state.profile, 
+        help="Profile each chat turn with cProfile and tracemalloc and save the report."
+    )
+
     st.session_state.number_of_resources = st.number_input(
         "Number of Resources", 
         min_value=1, 
@@ -83,9 +107,20 @@ rag = OllamaRAG(
     performance=st.session_state.performance_mode,
     web_search=st.session_state.search_web,
     context_search=st.session_state.context_search,
-    deep_search=st.session_state.deep_search
+    deep_search=st.session_state.deep_search,
+    adaptive_web_search=st.session_state.adaptive_web_search,
+    ollama_context=st.session_state.ollama_context,
+    profile=st.session_state.profile
 )
 
+# Preload the selected model so the first chat does not pay the load time.
+# The KV-context belongs to the previous model, so drop it on a switch.
+if st.session_state.loaded_model != st.session_state.model:
+    rag.reset_session()
+    st.session_state.ollama_context = None
+    if rag.warm_model():
+        st.session_state.loaded_model = st.session_state.model
+
 # Sidebar
 st.sidebar.title("Navigation")
 page = st.sidebar.radio("Select Page", ["Chat", "Resources", "Conversation History", "Add Resource"])
@@ -126,8 +161,15 @@ if page == "Chat":
             with st.chat_message("assistant"):
                 with st.spinner("Thinking..."):
                     response, resources, info = rag.chat(prompt)
+                    st.session_state.ollama_context = rag.ollama_context
+                    profile = info.pop("profile", None)
                     st.write(info)
                     st.write(response)
+
+                    if isinstance(profile, dict):
+                        with st.expander(f"Profile ({profile['wall_seconds']:.2f}s)"):
+                            st.code(profile["summary"])
+                            st.caption(f"Saved to {profile['prof_file']}")
                     
                     if resources:
                         with st.expander("Referenced Resources"):
@@ -152,20 +194,27 @@ elif page == "Resources":
 
     # Search functionality
     search_query = st.text_input("Search for a resource by name or description:")
-    resources = rag.db.get_all_resources()
 
+    # Filtered in SQL and read one page at a time, full contents are only loaded in the details view
+    where, params = None, ()
     if search_query:
-        resources = [res for res in resources 
-                     if search_query.lower() in res[1].lower() or search_query.lower() in res[2].lower()]
+        where = "name LIKE ? OR description LIKE ?"
+        params = (f"%{search_query}%", f"%{search_query}%")
+    total = rag.db.count_rows("resources", where, params)
 
-    if resources:
-        st.write("Total Resources:", len(resources))
-        df = pd.DataFrame(resources, columns=["ID", "Name", "Description", "Content", "Created At", "Tags"])
+    if total:
+        st.write("Total Resources:", total)
+        page_number = st.number_input("Page", min_value=1, max_value=(total - 1) // PAGE_SIZE + 1, value=1)
+        resources = rag.db.iter_resources(
+            "id, name, description, created_at, tags", where, params,
+            limit=PAGE_SIZE, offset=(page_number - 1) * PAGE_SIZE
+        )
+        df = pd.DataFrame(resources, columns=["ID", "Name", "Description", "Created At", "Tags"])
         st.dataframe(df, use_container_width=True)
 
         # Resource details expander
         with st.expander("View Resource Details"):
-            resource_id = st.number_input("Enter Resource ID", min_value=1, max_value=len(resources))
+            resource_id = st.number_input("Enter Resource ID", min_value=1)
             if st.button("Show Details"):
                 resource = rag.db.get_resource(resource_id)
                 if resource:
@@ -181,20 +230,26 @@ elif page == "Conversation History":
 
     # Search functionality
     search_query = st.text_input("Search for a conversation by user input or assistant response:")
-    conversations = rag.db.get_all_conversations()
 
+    where, params = None, ()
     if search_query:
-        conversations = [conv for conv in conversations 
-                           if search_query.lower() in conv[1].lower() or search_query.lower() in conv[2].lower()]
+        where = "user_input LIKE ? OR assistant_response LIKE ?"
+        params = (f"%{search_query}%", f"%{search_query}%")
+    total = rag.db.count_rows("conversations", where, params)
 
-    if conversations:
-        st.write("Total Conversations:", len(conversations))
+    if total:
+        st.write("Total Conversations:", total)
+        page_number = st.number_input("Page", min_value=1, max_value=(total - 1) // PAGE_SIZE + 1, value=1)
+        conversations = rag.db.iter_conversations(
+            where=where, params=params,
+            limit=PAGE_SIZE, offset=(page_number - 1) * PAGE_SIZE
+        )
         df = pd.DataFrame(conversations, columns=["ID", "User Input", "Assistant Response", "Created At"])
         st.dataframe(df, use_container_width=True)
 
         # Conversation details expander
         with st.expander("View Conversation Details"):
-            conv_id = st.number_input("Enter Conversation ID", min_value=1, max_value=len(conversations))
+            conv_id = st.number_input("Enter Conversation ID", min_value=1)
             if st.button("Show Details"):
                 conv = rag.db.get_conversation(conv_id)
                 if conv:
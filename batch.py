@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import queue
+import argparse
+import threading
+from main import OllamaRAG, CODDER_MODEL
+from llm_gateway import configure_gateway
+
+STOP = object()
+
+
+def read_questions(path: str, id_field: str, question_field: str):
+    """Yields (id, question, record) from a JSONL file, ids default to the line number."""
+    with open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {question_field: record}
+            yield str(record.get(id_field, line_number)), record[question_field], record
+
+
+def load_checkpoint(path: str) -> set:
+    """Ids already answered in an earlier run. Failed questions are retried."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a partial last line
+                continue
+            if "error" not in record:
+                done.add(str(record["id"]))
+    return done
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def summarize(results: list, wall_seconds: float) -> dict:
+    ok = [r for r in results if "error" not in r]
+    latencies = [r["latency_seconds"] for r in ok]
+    stages = {}
+    for r in ok:
+        for stage, seconds in r["timings"].items():
+            stages.setdefault(stage, []).append(seconds)
+    return {
+        "processed": len(results),
+        "succeeded": len(ok),
+        "failed": len(results) - len(ok),
+        "wall_seconds": wall_seconds,
+        "throughput_per_minute": len(ok) / wall_seconds * 60 if wall_seconds > 0 else 0.0,
+        "latency_mean": sum(latencies) / len(latencies) if latencies else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies) if latencies else 0.0,
+        "stage_mean_seconds": {stage: sum(v) / len(v) for stage, v in stages.items()}
+    }
+
+
+def run_batch(input_path: str, output_path: str, concurrency: int = 2, queue_size: int = None, id_field: str = "id", question_field: str = "question", llm_concurrency: int = None, **rag_kwargs) -> dict:
+    """
+    Answers every question of a JSONL file and appends one JSON line per answer to `output_path`.
+
+    Questions flow through a bounded queue to `concurrency` workers, each with its own
+    OllamaRAG. The output file doubles as the checkpoint: ids already answered are
+    skipped, so an interrupted run resumes where it stopped. The answer cache and the
+    conversation history are off unless passed in `rag_kwargs`. All workers share one LLM
+    gateway that runs up to `llm_concurrency` Ollama calls at once, `concurrency` by default.
+    """
+    configure_gateway(max_concurrency=llm_concurrency or concurrency)
+    # Answers must not depend on earlier runs or on which question happened to go first
+    rag_kwargs.setdefault("answer_cache", False)
+    rag_kwargs.setdefault("conversation_memory", False)
+    done = load_checkpoint(output_path)
+    if done:
+        print(f"Resuming, {len(done)} questions already answered", file=sys.stderr)
+
+    # Built one after another: the first instance tags untagged resources, the others find nothing left to do
+    rags = [OllamaRAG(**rag_kwargs) for _ in range(concurrency)]
+
+    work = queue.Queue(maxsize=queue_size or concurrency * 2)
+    write_lock = threading.Lock()
+    results = []
+
+    def worker(rag: OllamaRAG):
+        while True:
+            item = work.get()
+            if item is STOP:
+                return
+            qid, question, record = item
+            start = time.time()
+            try:
+                # Questions are independent, the KV-context of the previous one must not leak in
+                rag.reset_session()
+                response, web_resources, info = rag.chat(question)
+                out = {
+                    "id": qid,
+                    "question": question,
+                    "answer": response,
+                    "local_resources": info.get("local_resources", []),
+                    "web_resources": [{"name": r.get("name"), "url": r.get("url")} for r in web_resources],
+                    "timings": info.get("timings", {}),
+                    "cache": info.get("cache"),
+                    "latency_seconds": time.time() - start
+                }
+            except Exception as e:
+                out = {"id": qid, "question": question, "error": str(e), "latency_seconds": time.time() - start}
+            if "expected" in record:
+                out["expected"] = record["expected"]
+
+            with write_lock:
+                out_file.write(json.dumps(out, ensure_ascii=False) + "\n")
+                out_file.flush()
+                results.append(out)
+                print(f"[{len(results)}] {qid} {'failed' if 'error' in out else 'done'} in {out['latency_seconds']:.1f}s", file=sys.stderr)
+
+    start = time.time()
+    with open(output_path, "a") as out_file:
+        threads = [threading.Thread(target=worker, args=(rag,), daemon=True) for rag in rags]
+        for t in threads:
+            t.start()
+
+        try:
+            for qid, question, record in read_questions(input_path, id_field, question_field):
+                if qid in done:
+                    continue
+                done.add(qid)
+                work.put((qid, question, record))
+        finally:
+            for _ in threads:
+                work.put(STOP)
+            for t in threads:
+                t.join()
+
+    return summarize(results, time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with OllamaRAG.")
+    parser.add_argument("input", help="JSONL file, one object per line with a question field (and optionally id, expected)")
+    parser.add_argument("output", help="JSONL file the answers are appended to, also used to resume")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--queue-size", type=int, default=None)
+    parser.add_argument("--llm-concurrency", type=int, default=None, help="Ollama calls in flight at once, defaults to --concurrency")
+    parser.add_argument("--model", default=CODDER_MODEL)
+    parser.add_argument("--db", default="ragV2.db")
+    parser.add_argument("--id-field", default="id")
+    parser.add_argument("--question-field", default="question")
+    parser.add_argument("--no-web", action="store_true", help="Disable web search")
+    parser.add_argument("--no-context", action="store_true", help="Disable local database search")
+    parser.add_argument("--deep-search", action="store_true")
+    parser.add_argument("--cache", action="store_true", help="Answer from stored conversations when a question was seen before")
+    parser.add_argument("--memory", action="store_true", help="Use past conversations as history and store every answer")
+    parser.add_argument("--sequential-retrieval", action="store_true", help="Run local and web retrieval one after another")
+    parser.add_argument("--local-deadline", type=float, default=45.0, help="Seconds local retrieval may take")
+    parser.add_argument("--web-deadline", type=float, default=30.0, help="Seconds the web stage may take")
+    args = parser.parse_args()
+
+    summary = run_batch(
+        args.input, args.output,
+        concurrency=args.concurrency,
+        queue_size=args.queue_size,
+        llm_concurrency=args.llm_concurrency,
+        id_field=args.id_field,
+        question_field=args.question_field,
+        model_name=args.model,
+        db_path=args.db,
+        web_search=not args.no_web,
+        context_search=not args.no_context,
+        deep_search=args.deep_search,
+        answer_cache=args.cache,
+        conversation_memory=args.memory,
+        parallel_retrieval=not args.sequential_retrieval,
+        local_deadline_seconds=args.local_deadline,
+        web_deadline_seconds=args.web_deadline
+    )
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
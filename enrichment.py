@@ -0,0 +1,118 @@
+import json
+from typing import List, Iterable, Tuple
+
+# Token budget for the documents of one enrichment prompt, estimated as characters / 4
+ENRICH_TOKEN_BUDGET = 3000
+# Documents per enrichment prompt
+ENRICH_MAX_ITEMS = 8
+# Answer tokens kept free per document, a description and a few tags in JSON
+ENRICH_OUTPUT_TOKENS = 200
+
+MAX_TAGS = 10
+MAX_DESCRIPTION_CHARS = 1000
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def fit_to_window(num_ctx: int, prompt_tokens: int, token_budget: int = ENRICH_TOKEN_BUDGET, max_items: int = ENRICH_MAX_ITEMS) -> Tuple[int, int]:
+    """
+    Shrinks the batch limits so the prompt, the documents and the JSON answer fit in a
+    `num_ctx` window. Returns (token budget, max items), both at least 1.
+    """
+    available = num_ctx - prompt_tokens
+    max_items = max(1, min(max_items, available // (2 * ENRICH_OUTPUT_TOKENS)))
+    return max(1, min(token_budget, available - max_items * ENRICH_OUTPUT_TOKENS)), max_items
+
+
+def pack_batches(contents: List[str], token_budget: int = ENRICH_TOKEN_BUDGET, max_items: int = ENRICH_MAX_ITEMS) -> List[List[int]]:
+    """
+    Greedily groups document indexes, in order, so each group stays within `token_budget`
+    and `max_items`. A document larger than the budget goes into a group of its own.
+    """
+    batches = []
+    current, used = [], 0
+    for i, content in enumerate(contents):
+        tokens = estimate_tokens(content)
+        if current and (used + tokens > token_budget or len(current) >= max_items):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def format_documents(documents: Iterable[Tuple[str, str]]) -> str:
+    """(id, content) pairs as numbered prompt sections."""
+    return "\n\n".join(f"### Document {doc_id}\n{content}" for doc_id, content in documents)
+
+
+def _clean_tags(tags) -> List[str]:
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    if not isinstance(tags, list):
+        return []
+    cleaned = []
+    for tag in tags:
+        if not isinstance(tag, str):
+            continue
+        tag = tag.strip().strip("#").strip()
+        if tag and tag.lower() not in (t.lower() for t in cleaned):
+            cleaned.append(tag)
+    return cleaned[:MAX_TAGS]
+
+
+def validate_item(item) -> dict:
+    """
+    Checks one enrichment item. Returns {"description": str, "tags": "a, b, c"} in the
+    format stored in the database, or None when the item is unusable.
+    """
+    if not isinstance(item, dict):
+        return None
+    description = item.get("description")
+    if not isinstance(description, str) or not description.strip():
+        return None
+    tags = _clean_tags(item.get("tags"))
+    if not tags:
+        return None
+    return {"description": description.strip()[:MAX_DESCRIPTION_CHARS], "tags": ", ".join(tags)}
+
+
+def parse_enrichment(text: str, expected_ids: Iterable[str]) -> dict:
+    """
+    Parses a JSON enrichment response into {id: item} for the valid items among
+    `expected_ids`. Accepts {"items": [...]}, a bare list, or a mapping of id to item.
+    Malformed JSON yields an empty dict, so every id counts as failed.
+    """
+    expected = {str(i) for i in expected_ids}
+    try:
+        data = json.loads(text)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
+    if isinstance(data, dict) and isinstance(data.get("items"), list):
+        entries = [(str(item.get("id")), item) for item in data["items"] if isinstance(item, dict)]
+    elif isinstance(data, list):
+        entries = [(str(item.get("id")), item) for item in data if isinstance(item, dict)]
+    elif isinstance(data, dict):
+        entries = [(str(key), item) for key, item in data.items()]
+    else:
+        return {}
+
+    # A single document answered without an id is still unambiguous
+    if len(expected) == 1 and len(entries) == 1 and entries[0][0] not in expected:
+        entries = [(next(iter(expected)), entries[0][1])]
+    # ...and so is a single document answered with the bare item
+    if len(expected) == 1 and isinstance(data, dict) and "description" in data:
+        entries = [(next(iter(expected)), data)]
+
+    parsed = {}
+    for doc_id, item in entries:
+        if doc_id in expected and doc_id not in parsed:
+            valid = validate_item(item)
+            if valid is not None:
+                parsed[doc_id] = valid
+    return parsed
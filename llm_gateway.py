@@ -0,0 +1,158 @@
+import json
+import heapq
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import Tuple
+
+# Lower value is served first
+PRIORITY_ANSWER = 0
+PRIORITY_RETRIEVAL = 1
+PRIORITY_BACKGROUND = 2
+
+PRIORITY_NAMES = {PRIORITY_ANSWER: "answer", PRIORITY_RETRIEVAL: "retrieval", PRIORITY_BACKGROUND: "background"}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class OllamaGateway:
+    """
+    Shared front door to the local Ollama server for every OllamaRAG in the process.
+
+    - Identical in-flight requests are coalesced: followers wait for the leader's response.
+    - At most `max_concurrency` requests run at once; waiting requests are admitted by
+      priority (final answers before retrieval prompts before background tagging), then FIFO.
+    - Requests go through one pooled requests.Session with timeouts and retries on
+      connection errors and 502/503/504.
+    """
+
+    def __init__(self, max_concurrency: int = 2, connect_timeout: float = 5, read_timeout: float = 600, retries: int = 2, backoff: float = 0.5):
+        self.max_concurrency = max_concurrency
+        self.timeout = (connect_timeout, read_timeout)
+
+        retry = Retry(
+            total=retries, connect=retries, read=0, status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"POST"})
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=4, pool_maxsize=max(max_concurrency, 4))
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self._admission = threading.Condition(self._lock)
+        self._waiting = []
+        self._seq = 0
+        self._active = 0
+        self._inflight = {}
+        self._stats = {
+            name: {"requests": 0, "coalesced": 0, "errors": 0, "queue_seconds": 0.0, "max_queue_seconds": 0.0, "service_seconds": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+
+    def _acquire(self, priority: int) -> None:
+        with self._admission:
+            self._seq += 1
+            ticket = (priority, self._seq)
+            heapq.heappush(self._waiting, ticket)
+            while self._active >= self.max_concurrency or self._waiting[0] != ticket:
+                self._admission.wait()
+            heapq.heappop(self._waiting)
+            self._active += 1
+            # The next ticket in line may be admissible too
+            self._admission.notify_all()
+
+    def _release(self) -> None:
+        with self._admission:
+            self._active -= 1
+            self._admission.notify_all()
+
+    def post(self, url: str, payload: dict, priority: int = PRIORITY_RETRIEVAL, coalesce: bool = True) -> Tuple[dict, dict]:
+        """
+        Sends a JSON request to Ollama. Returns (response json, meta) where meta holds
+        `queue_seconds`, `service_seconds` and whether the call was `coalesced`.
+        """
+        stats = self._stats[PRIORITY_NAMES.get(priority, "background")]
+        key = url + "\n" + json.dumps(payload, sort_keys=True) if coalesce else None
+
+        with self._lock:
+            flight = self._inflight.get(key) if key else None
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                if key:
+                    self._inflight[key] = flight
+            stats["requests"] += 1
+            if not leader:
+                stats["coalesced"] += 1
+
+        if not leader:
+            start = time.time()
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, {"queue_seconds": 0.0, "service_seconds": time.time() - start, "coalesced": True}
+
+        queued_at = time.time()
+        self._acquire(priority)
+        queue_seconds = time.time() - queued_at
+        started_at = time.time()
+        try:
+            response = self.session.post(url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            flight.result = response.json()
+        except Exception as e:
+            flight.error = e
+        finally:
+            self._release()
+            service_seconds = time.time() - started_at
+            with self._lock:
+                if key:
+                    self._inflight.pop(key, None)
+                stats["queue_seconds"] += queue_seconds
+                stats["max_queue_seconds"] = max(stats["max_queue_seconds"], queue_seconds)
+                stats["service_seconds"] += service_seconds
+                if flight.error is not None:
+                    stats["errors"] += 1
+            flight.done.set()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result, {"queue_seconds": queue_seconds, "service_seconds": service_seconds, "coalesced": False}
+
+    def stats(self) -> dict:
+        with self._lock:
+            snapshot = {name: dict(s) for name, s in self._stats.items()}
+            snapshot["active"] = self._active
+            snapshot["waiting"] = len(self._waiting)
+            return snapshot
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway(**kwargs) -> OllamaGateway:
+    """Returns the process-wide gateway, created with `kwargs` on first use."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = OllamaGateway(**kwargs)
+        return _gateway
+
+
+def configure_gateway(**kwargs) -> OllamaGateway:
+    """Replaces the process-wide gateway, e.g. to change the concurrency limit."""
+    global _gateway
+    with _gateway_lock:
+        _gateway = OllamaGateway(**kwargs)
+        return _gateway
@@ -1,9 +1,16 @@
 import requests
 from RAG_DB import RAGDB
-from bs4 import BeautifulSoup
+from tokenizer import query_terms, term_set
+from web_extract import fetch_page_text, PAGE_MAX_CHARS
+from profiling import profile_call, profiling_enabled
+from llm_gateway import get_gateway, PRIORITY_ANSWER, PRIORITY_RETRIEVAL, PRIORITY_BACKGROUND
+from retrieval import get_orchestrator, Deadline
+from enrichment import pack_batches, format_documents, parse_enrichment, fit_to_window, estimate_tokens, ENRICH_TOKEN_BUDGET, ENRICH_MAX_ITEMS
 from duckduckgo_search import DDGS
 import time
 import re
+import threading
+from typing import Optional, List, Tuple
 
 CODDER_MODEL = "qwen2.5-coder:3b"
 DEEP_SEEK_MODEL = "deepseek-r1:1.5b"
@@ -15,115 +22,445 @@ DEEP_SEEK_MODEL_NORMAL = "deepseek-r1:8b"
 DEEP_SEEK_MODEL_NORMAL_V2 = "deepseek-r1:7b"
 
 
+# How long Ollama keeps a model loaded after the last request
+KEEP_ALIVE = "30m"
+
+# Context window requested from Ollama on every call. It must not change between
+# calls, a different num_ctx makes Ollama reload the model
+NUM_CTX = 8192
+# Tokens kept free for the answer when the KV-context of the last turn is reused
+ANSWER_RESERVE_TOKENS = 1024
+
+# Share of the web deadline spent fetching pages, the rest is left for deep search and the summary
+WEB_FETCH_SHARE = 0.5
+# Length of the content snippet used as description when the search result has none
+WEB_SNIPPET_CHARS = 300
+
+# Prompt templates. The static instructions come first and never change between
+# calls so Ollama can reuse the cached prefix, the per-call data goes last.
+DESCRIPTION_PROMPT = """You are an AI assistant responsible for summarizing resources for a knowledge database.
+
+### Instructions:
+- Provide a **concise and informative** summary of the resource.
+- The description should be **2-3 sentences long**.
+- Clearly convey the **main topic** and **key points** of the content.
+- Avoid unnecessary details but ensure the description is useful for search.
+
+### Resource Content:
+{content}
+
+### Generated Description:
+"""
+
+TAGS_PROMPT = """You are an AI assistant responsible for generating relevant tags for a given resource.
+
+### Instructions:
+- Provide **3-7 highly relevant** tags that best describe the resource.
+- Tags should be **short, precise, and meaningful** (e.g., 'Machine Learning', 'Cybersecurity').
+- If the resource covers multiple topics, include diverse yet related tags.
+- **Avoid generic words** like "information", "article", or "document".
+
+### Resource Content:
+{content}
+
+### Generated Tags (comma-separated):
+"""
+
+ENRICH_PROMPT = """You are an AI assistant that prepares resources for a knowledge database.
+
+### Instructions:
+For **every** document below provide:
+- "description": a **concise and informative** summary, **2-3 sentences long**, that conveys the main topic and key points and is useful for search.
+- "tags": **3-7 highly relevant** tags that are short, precise and meaningful (e.g., 'Machine Learning', 'Cybersecurity'). Avoid generic words like "information", "article", or "document".
+
+Answer with JSON only, one item per document, using the document numbers as ids:
+{{"items": [{{"id": "1", "description": "...", "tags": ["...", "..."]}}]}}
+
+### Documents:
+{documents}
+
+### JSON:
+"""
+
+SEARCH_DESCRIPTION_PROMPT = """You are an expert in information retrieval. Given the following user query, generate a concise and optimized search description that captures its key intent and meaning.
+
+### Requirements:
+- The description should be **1-2 sentences long**.
+- Avoid unnecessary words but retain key context.
+- Make it **search-friendly** by using commonly used terms.
+
+### User Query:
+{query}
+
+### Optimized Search Description:
+"""
+
+KEYWORDS_PROMPT = """Given the following user query, generate **5 highly relevant search keywords** that can be used to find related information.
+
+### Requirements:
+- Provide **only** 5 keywords separated by commas (e.g., "AI, machine learning, deep learning, neural networks, NLP").
+- Focus on **key terms** that enhance search accuracy.
+- Prioritize **broad but meaningful** keywords.
+
+### User Query:
+{query}
+
+### Keywords:
+"""
+
+RANK_PROMPT = """You are an AI ranking system. Given the **user query** and a **resource**, assign a **relevance score from 1 to 100** based on how useful the resource is in answering the query.
+
+### Instructions:
+- Score must be **between 1 and 100**.
+- A **higher score (closer to 100)** means the resource is very relevant.
+- A **lower score (closer to 1)** means the resource is mostly irrelevant.
+- Provide **only** the numerical score (no explanations).
+
+### User Query:
+{query}
+
+### Resource Content:
+{content}
+
+### Resource Description:
+{description}
+
+### Relevance Score:
+"""
+
+WEB_QUERY_PROMPT = """Generate an effective and precise search query that can be used to find high-quality, relevant, and up-to-date information from the web.
+The query should be optimized for search engines like Google and focus on retrieving authoritative sources, blogs, research papers, or forums.
+
+Ensure the query:
+- Uses relevant keywords and phrases.
+- Avoids unnecessary words or ambiguity.
+- Targets reputable sources for the best information.
+- Is structured concisely for accurate search results.
+
+Provide only the search query without additional explanation.
+
+Context: {user_input}
+"""
+
+DEEP_SEARCH_PROMPT = """Generate ONE additional search query following these rules:
+1. Focus on key concepts or topics that need more detail
+2. Identify gaps in the current search results
+3. Use specific, relevant keywords
+4. Keep the query under 10 words
+5. Exclude generic terms
+6. Format: clear, concise search terms
+
+Return ONLY the search query without explanation.
+
+Original user query: "{user_input}"
+Initial web search results: {context_from_web}
+"""
+
+WEB_SUMMARY_PROMPT = """You are an advanced AI assistant designed to extract key information from provided sources.
+
+## **Task:**
+Summarize the most relevant and important insights from the retrieved web content to help answer the user query given at the end.
+
+## **Instructions:**
+1. **Extract Key Insights:** Identify the most valuable information relevant to answering the user’s query.
+2. **Filter Out Irrelevant Details:** Remove redundant or off-topic content.
+3. **Summarize Clearly and Concisely:** Provide a structured summary in a few paragraphs or bullet points.
+4. **Prioritize Recent & Reliable Sources:** Highlight the most authoritative and up-to-date information.
+5. **Maintain Neutrality:** Present the summary in an objective manner without adding opinions.
+
+## **Output Format:**
+Provide a structured summary that is easy to understand and directly useful in answering the user’s query.
+
+## **Web Content:**
+{context_from_web}
+
+### **User Query:**
+{user_input}
+"""
+
+RAG_WEB_PROMPT = """You are an intelligent assistant designed to provide accurate and context-aware responses.
+
+### **Instructions:**
+1. **Synthesize Information:** Combine relevant details from the provided context, web search results, and past conversations.
+2. **Prioritize Relevance:** Focus on the most important and up-to-date facts to answer the question accurately.
+3. **Ensure Clarity & Concisiveness:** The response should be clear, well-structured, and concise while covering key points.
+4. **Avoid Redundancy:** If a previous conversation already addressed this, summarize the past response and add new insights if necessary.
+5. **Cite Sources If Applicable:** If information is derived from web search results, indicate it subtly.
+
+{context_section}
+## **Web Search Results:**
+{context_from_web}
+
+## **Relevant Past Conversations:**
+{history}
+
+### **User Query:**
+{user_input}
+
+### **Your Response:**
+"""
+
+RAG_PROMPT = """You are an intelligent assistant designed to provide accurate and context-aware responses.
+
+### **Instructions:**
+1. **Synthesize Information:** Combine relevant details from the provided context and past conversations.
+2. **Prioritize Relevance:** Focus on the most important facts to answer the question accurately.
+3. **Ensure Clarity & Concisiveness:** The response should be clear, well-structured, and concise while covering key points.
+4. **Avoid Redundancy:** If a previous conversation already addressed this, summarize the past response and add new insights if necessary.
+
+{context_section}
+## **Relevant Past Conversations:**
+{history}
+
+### **User Query:**
+{user_input}
+
+### **Your Response:**
+"""
+
+WEB_NEEDED_PROMPT = """You decide whether a web search is needed. Given a user query and the context found in the local knowledge base,
+answer YES if the context is missing information needed to answer the query, or NO if the context is enough.
+Answer with a single word: YES or NO.
+
+### Local Context:
+{context}
+
+### User Query:
+{user_input}
+
+### Answer:
+"""
+
+REFRESH_PROMPT = """You are an intelligent assistant. A previous answer to a very similar question is given below.
+Adapt it so it answers the new question. Keep everything that still applies and change only what the new question requires.
+
+### Previous Question:
+{cached_input}
+
+### Previous Answer:
+{cached_response}
+
+### New Question:
+{user_input}
+
+### Your Response:
+"""
+
+
 def stripThink(text):
     return re.sub(r'<think>.*?</think>', '', text, flags=re.DOTALL)
 
 class OllamaRAG:
-    def __init__(self, model_name: str = CODDER_MODEL, db_path: str = "ragV2.db", performance: bool = True , web_search: bool = True, context_search: bool = True , deep_search: bool = False, number_of_searches: int = 3):
+    # Average duration of the web stage across instances, in seconds
+    web_stage_seconds = None
+
+    def __init__(self, model_name: str = CODDER_MODEL, db_path: str = "ragV2.db", performance: bool = True , web_search: bool = True, context_search: bool = True , deep_search: bool = False, number_of_searches: int = 3, keep_alive: str = KEEP_ALIVE, ollama_context: Optional[List[int]] = None, num_ctx: int = NUM_CTX, max_context_tokens: Optional[int] = None, answer_cache: bool = True, cache_threshold: float = 0.92, cache_max_age_hours: Optional[float] = 24 * 7, cache_refresh: bool = True, adaptive_web_search: bool = False, web_confidence_threshold: float = 0.6, web_classifier: bool = False, deep_search_coverage: float = 0.8, history_token_budget: int = 1500, db: Optional[RAGDB] = None, retention: Optional[dict] = None, profile: Optional[bool] = None, parallel_retrieval: bool = True, local_deadline_seconds: Optional[float] = 45.0, web_deadline_seconds: Optional[float] = 30.0, batched_enrichment: bool = True, enrich_token_budget: int = ENRICH_TOKEN_BUDGET, enrich_max_items: int = ENRICH_MAX_ITEMS, enrich_retries: int = 1, conversation_memory: bool = True):
         self.model_name = model_name
         self.api_url = "http://localhost:11434/api/generate"
-        self.db = RAGDB(db_path)
+        self.keep_alive = keep_alive
+        # KV-context returned by Ollama for the last answer, reused on the next turn
+        self.ollama_context = ollama_context
+        self.num_ctx = num_ctx
+        # Reused context never takes more than half the window by default
+        self.max_context_tokens = max_context_tokens if max_context_tokens is not None else num_ctx // 2
+        # LLM calls of the current turn as seen by the gateway
+        self.llm_stats = {"calls": 0, "queue_seconds": 0.0, "coalesced": 0}
+        # Retrieval sources and background ingestion update the stats from other threads
+        self._stats_lock = threading.Lock()
+        # Any object with the RAGDB interface works here, e.g. a ShardedRAGDB
+        self.db = db if db is not None else RAGDB(db_path)
+        # e.g. {"interval_seconds": 3600, "max_rows": 5000, "web_ttl_days": 30}
+        if retention:
+            self.db.start_compaction(**retention)
         self.number_of_previous_conversations = 8
+        self.history_token_budget = history_token_budget
+        # Descriptions and tags come from one JSON call per batch of documents, see enrich_documents
+        self.batched_enrichment = batched_enrichment
+        self.enrich_token_budget = enrich_token_budget
+        self.enrich_max_items = enrich_max_items
+        self.enrich_retries = enrich_retries
+        self.enrich_stats = {"documents": 0, "calls": 0, "retried_items": 0, "fallbacks": 0, "prompt_chars": 0}
         self.generate_tags_for_resource()
         self.performance = performance
         self.web_search = web_search
         self.context_search = context_search
         self.deep_search = deep_search
         self.number_of_searches = number_of_searches
-
-    def _call_ollama(self, prompt: str) -> str:
+        # Per-turn cProfile + tracemalloc reports, defaults to the RAG_PROFILE env var
+        self.profile = profiling_enabled() if profile is None else profile
+        # Answer cache over past conversations, see _answer_from_cache
+        self.answer_cache = answer_cache
+        self.cache_threshold = cache_threshold
+        self.cache_max_age_hours = cache_max_age_hours
+        self.cache_refresh = cache_refresh
+        # Past conversations in the prompt and storing every turn, off for independent evaluation runs
+        self.conversation_memory = conversation_memory
+        # Adaptive web search, see _should_search_web
+        self.adaptive_web_search = adaptive_web_search
+        self.web_confidence_threshold = web_confidence_threshold
+        self.web_classifier = web_classifier
+        self.deep_search_coverage = deep_search_coverage
+        # Local and web retrieval run concurrently, each bounded by its deadline, see _chat
+        self.parallel_retrieval = parallel_retrieval
+        self.local_deadline_seconds = local_deadline_seconds
+        self.web_deadline_seconds = web_deadline_seconds
+
+    def _generate(self, prompt: str, context: Optional[List[int]] = None, priority: int = PRIORITY_RETRIEVAL, format: Optional[str] = None) -> dict:
         payload = {
             "model": self.model_name,
             "prompt": prompt,
             "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {"num_ctx": self.num_ctx},
         }
-        response = requests.post(self.api_url, json=payload)
-        return response.json()['response']
-    
-    def add_resource(self, name: str, content: str) -> dict:
+        if context:
+            payload["context"] = context
+        if format:
+            # Constrains the output, e.g. "json"
+            payload["format"] = format
+        # All sessions share one gateway: identical prompts are coalesced, admission is by priority
+        result, meta = get_gateway().post(self.api_url, payload, priority)
+        with self._stats_lock:
+            self.llm_stats["calls"] += 1
+            self.llm_stats["queue_seconds"] += meta["queue_seconds"]
+            self.llm_stats["coalesced"] += int(meta["coalesced"])
+        return result
+
+    def _call_ollama(self, prompt: str, priority: int = PRIORITY_RETRIEVAL) -> str:
+        return self._generate(prompt, priority=priority)['response']
+
+    def warm_model(self) -> bool:
         """
-        Adds a new resource to the database with an AI-generated description.
-
-        - Generates a **concise and informative** description of the resource content.
-        - Ensures the description is **clear, relevant, and useful** for future retrieval.
-
-        Returns a dictionary containing the resource name, description, and tags.
+        Loads the model into memory ahead of the first chat and keeps it resident for `keep_alive`.
+        A generate request without a prompt only loads the model.
         """
+        try:
+            get_gateway().post(self.api_url, {"model": self.model_name, "keep_alive": self.keep_alive, "options": {"num_ctx": self.num_ctx}}, PRIORITY_BACKGROUND)
+            return True
+        except requests.RequestException as e:
+            print(f"Error warming model {self.model_name}: {str(e)}")
+            return False
 
-        # **Optimized Description Prompt**
-        description_prompt = f"""
-        You are an AI assistant responsible for summarizing resources for a knowledge database.
-
-        ### Resource Content:
-        {content}
-
-        ### Instructions:
-        - Provide a **concise and informative** summary of the resource.
-        - The description should be **2-3 sentences long**.
-        - Clearly convey the **main topic** and **key points** of the content.
-        - Avoid unnecessary details but ensure the description is useful for search.
+    def reset_session(self) -> None:
+        self.ollama_context = None
 
-        ### Generated Description:
+    def _reusable_context(self, prompt: str) -> Optional[List[int]]:
         """
-        start = time.time()
-        description = self._call_ollama(description_prompt)
-        description = stripThink(description)
-        print("Average time for word generation: ", (time.time() - start) / len(description.split()))
-        print(f"-"*15)
-
-        tags_prompt = f"""
-        You are an AI assistant responsible for generating relevant tags for a given resource.
-
-        ### Resource Content:
-        {content}
-
-        ### Instructions:
-        - Provide **3-7 highly relevant** tags that best describe the resource.
-        - Tags should be **short, precise, and meaningful** (e.g., 'Machine Learning', 'Cybersecurity').
-        - If the resource covers multiple topics, include diverse yet related tags.
-        - **Avoid generic words** like "information", "article", or "document".
+        The KV-context of the last turn if it still fits in `num_ctx` together with `prompt`
+        (estimated as characters / 4) and `ANSWER_RESERVE_TOKENS` for the answer, else None.
+        Ollama would otherwise silently truncate the start of the input.
+        """
+        if not self.ollama_context:
+            return None
+        if len(self.ollama_context) + len(prompt) // 4 + ANSWER_RESERVE_TOKENS > self.num_ctx:
+            print("Dropping reused context, it would not fit the context window")
+            self.ollama_context = None
+            return None
+        return self.ollama_context
+    
+    def add_resource(self, name: str, content: str, source: str = "manual") -> dict:
+        """
+        Adds a new resource to the database with an AI-generated description and tags.
 
-        ### Generated Tags (comma-separated):
+        Returns a dictionary containing the resource name, description, and tags.
         """
+        return self.add_resources([(name, content)], source)[0]
 
+    def add_resources(self, items: List[Tuple[str, str]], source: str = "manual") -> List[dict]:
+        """
+        Adds several (name, content) resources, enriched together so short documents
+        share LLM calls. Returns one {name, description, tags} dictionary per item.
+        """
         start = time.time()
-        tags = self._call_ollama(tags_prompt)
-        tags = stripThink(tags)
-        print("Average time for word generation: ", (time.time() - start) / len(tags.split()))
+        enriched = self.enrich_documents([content for _, content in items])
+        print(f"Enriched {len(items)} resources in {time.time() - start:.1f}s")
         print(f"-"*15)
 
-
-        # **Add resource to the database**
-        self.db.add_resource(name, content, description, tags)
-
-        return {"name": name, "description": description, "tags": tags}
-
-
-    def _get_relevant_context(self, query: str, n_results: int = 8) -> str:
+        added = []
+        for (name, content), item in zip(items, enriched):
+            # **Add resource to the database**
+            self.db.add_resource(name, content, item["description"], item["tags"], source)
+            added.append({"name": name, "description": item["description"], "tags": item["tags"]})
+        return added
+
+    def _enrich_single(self, content: str) -> dict:
+        # Original two-prompt path, used when batching is off and for items that keep failing validation
+        description = stripThink(self._call_ollama(DESCRIPTION_PROMPT.format(content=content), PRIORITY_BACKGROUND))
+        tags = stripThink(self._call_ollama(TAGS_PROMPT.format(content=content), PRIORITY_BACKGROUND))
+        with self._stats_lock:
+            self.enrich_stats["calls"] += 2
+            self.enrich_stats["prompt_chars"] += 2 * len(content)
+        return {"description": description.strip(), "tags": tags.strip()}
+
+    def enrich_documents(self, contents: List[str]) -> List[dict]:
+        """
+        Generates a description and tags for every document, in input order.
+
+        Documents are packed into prompts of at most `enrich_max_items` documents and
+        `enrich_token_budget` estimated tokens, both lowered where needed so prompt and answer
+        fit in `num_ctx`, and each prompt asks for a JSON list with one item per document.
+        A document longer than the budget is cut to it. Items that are missing or fail validation are retried on
+        their own batch up to `enrich_retries` times, then fall back to the separate
+        description and tags prompts.
+        """
+        results = [None] * len(contents)
+        with self._stats_lock:
+            self.enrich_stats["documents"] += len(contents)
+
+        if self.batched_enrichment:
+            token_budget, max_items = fit_to_window(
+                self.num_ctx, estimate_tokens(ENRICH_PROMPT), self.enrich_token_budget, self.enrich_max_items
+            )
+            # Ollama drops the start of an overlong prompt, which is where the instructions are
+            max_chars = token_budget * 4
+            for batch in pack_batches(contents, token_budget, max_items):
+                pending = list(batch)
+                for attempt in range(self.enrich_retries + 1):
+                    if not pending:
+                        break
+                    if attempt:
+                        with self._stats_lock:
+                            self.enrich_stats["retried_items"] += len(pending)
+                    ids = {str(n): i for n, i in enumerate(pending, start=1)}
+                    prompt = ENRICH_PROMPT.format(documents=format_documents((n, contents[i][:max_chars]) for n, i in ids.items()))
+                    try:
+                        response = stripThink(self._generate(prompt, priority=PRIORITY_BACKGROUND, format="json")['response'])
+                    except requests.RequestException as e:
+                        print(f"Enrichment request failed: {str(e)}")
+                        response = ""
+                    with self._stats_lock:
+                        self.enrich_stats["calls"] += 1
+                        self.enrich_stats["prompt_chars"] += len(prompt)
+
+                    for n, item in parse_enrichment(response, ids).items():
+                        results[ids[n]] = item
+                    pending = [i for i in pending if results[i] is None]
+
+        for i, content in enumerate(contents):
+            if results[i] is None:
+                if self.batched_enrichment:
+                    with self._stats_lock:
+                        self.enrich_stats["fallbacks"] += 1
+                results[i] = self._enrich_single(content)
+        return results
+
+
+    def _get_relevant_context(self, query: str, n_results: int = 8) -> Tuple[str, list, int]:
         """
         Retrieves the most relevant resources based on a query by:
         1. Generating a refined search description.
         2. Searching for resources in the database using the description and extracted keywords.
         3. Ranking the resources based on relevance.
         4. Returning the top `n_results` as a formatted string.
+
+        Returns (context, fused results, number of distinct sub-queries). Runs on a retrieval
+        thread that may outlive its deadline, so it leaves the instance state alone.
         """
 
         context = ""
 
         # **Step 1: Generate an Optimized Search Description**
-        search_query_prompt = f"""
-        You are an expert in information retrieval. Given the following user query, generate a concise and optimized search description that captures its key intent and meaning.
-
-        ### User Query:
-        {query}
-
-        ### Requirements:
-        - The description should be **1-2 sentences long**.
-        - Avoid unnecessary words but retain key context.
-        - Make it **search-friendly** by using commonly used terms.
-        
-        ### Optimized Search Description:
-        """
+        search_query_prompt = SEARCH_DESCRIPTION_PROMPT.format(query=query)
         description = self._call_ollama(search_query_prompt)
         description = stripThink(description)
 
@@ -143,19 +480,7 @@ class OllamaRAG:
                 })
 
         # **Step 3: Generate Additional Keywords for Better Resource Discovery**
-        keywords_prompt = f"""
-        Given the following user query, generate **5 highly relevant search keywords** that can be used to find related information.
-
-        ### User Query:
-        {query}
-
-        ### Requirements:
-        - Provide **only** 5 keywords separated by commas (e.g., "AI, machine learning, deep learning, neural networks, NLP").
-        - Focus on **key terms** that enhance search accuracy.
-        - Prioritize **broad but meaningful** keywords.
-
-        ### Keywords:
-        """
+        keywords_prompt = KEYWORDS_PROMPT.format(query=query)
         keywords = self._call_ollama(keywords_prompt).strip()
         keywords = stripThink(keywords)
         
@@ -177,26 +502,7 @@ class OllamaRAG:
 
             # **Step 4: Rank Resources by Relevance Using LLM**
             for resource in res_list:
-                rank_prompt = f"""
-                You are an AI ranking system. Given the **user query** and a **resource**, assign a **relevance score from 1 to 100** based on how useful the resource is in answering the query.
-
-                ### User Query:
-                {query}
-
-                ### Resource Content:
-                {resource['content']}
-
-                ### Resource Description:
-                {resource['description']}
-
-                ### Instructions:
-                - Score must be **between 1 and 100**.
-                - A **higher score (closer to 100)** means the resource is very relevant.
-                - A **lower score (closer to 1)** means the resource is mostly irrelevant.
-                - Provide **only** the numerical score (no explanations).
-
-                ### Relevance Score:
-                """
+                rank_prompt = RANK_PROMPT.format(query=query, content=resource['content'], description=resource['description'])
                 r = self._call_ollama(rank_prompt)
                 r = stripThink(r)
 
@@ -212,17 +518,14 @@ class OllamaRAG:
             # **Step 6: Format and Return Context**
             context = "\n".join([f"{r['name']}: {r['content']}" for r in res_list])
 
-        resV2 = self.db.search_resources(description , n_results)
-        resV2 += self.db.search_resources(query, n_results)
-
-        for k in keywords:
-            resV2 += self.db.search_resources(k, n_results)
-
         keyword_text = ""
         for k in keywords:
             keyword_text += f"{k} , "
-        resV2 += self.db.search_resources(keyword_text, n_results)
 
+        # All sub-queries go to the DB in one pass, rankings are fused with RRF
+        sub_queries = [description, query, *keywords, keyword_text]
+        resV2 = self.db.search_resources_multi(sub_queries, n_results)
+        n_queries = len({query_terms(q) for q in sub_queries if q} - {frozenset()})
 
         content_set = set()
 
@@ -238,71 +541,76 @@ class OllamaRAG:
         print("-"*15)
         context += text
         
-        return context
+        return context, resV2, n_queries
 
     
-    def _find_resources_on_web(self, query: str, num_results: int = 3):
+    def _fetch_web_page(self, query: str, result: dict) -> Optional[dict]:
+        """Fetches and cleans one search result, returns None when the page is unusable."""
+        url = result['href']
+        try:
+            headers = {'User-Agent': 'Mozilla/5.0'}
+            # Streamed with a byte cap, parsing stops once enough text is collected
+            content = fetch_page_text(url, headers=headers, timeout=10)
+            if content is None:
+                print(f"Skipping non-HTML page: {url}")
+                return None
+
+            # Clean and normalize text
+            content = re.sub(r'[^\w\s.,!?-]', '', content)  # Keep basic punctuation
+            content = content[:PAGE_MAX_CHARS]  # Limit content length
+
+            # Basic relevance check on normalised tokens, punctuation and case no longer break matches
+            if not query_terms(query) & term_set(content):
+                return None
+
+            if content.__contains__('404') or content.__contains__('Page not found') or content.__contains__('denied'):
+                return None
+
+            name = result['title']
+            print(f"Web Resource: {name} - {url}")
+            # The LLM description is written in the background, the turn shows the search snippet
+            description = (result.get('body') or content[:WEB_SNIPPET_CHARS]).strip()
+            return {'name': name, 'content': content, 'url': url, 'description': description, 'tags': ''}
+
+        except requests.RequestException as e:
+            print(f"Request error for {url}: {str(e)}")
+        except Exception as e:
+            print(f"Error processing {url}: {str(e)}")
+        return None
+
+    def _ingest_web_pages(self, pages: List[dict]) -> None:
+        # Add to web resources to db for future reference, runs on the ingestion pool
+        for r in self.add_resources([(page['name'], page['content']) for page in pages], source="web"):
+            print(f"Resource added: {r}")
+
+    def _ingest_web_page(self, page: dict) -> None:
+        self._ingest_web_pages([page])
+
+    def _find_resources_on_web(self, query: str, num_results: int = 3, deadline: Optional[Deadline] = None):
+        """
+        Searches the web and fetches the result pages in parallel.
+
+        Pages that arrive before `deadline` are returned; every usable page, including
+        the ones that arrive late, is stored (with LLM description and tags) in the
+        background, so ingestion never adds to the turn latency.
+        """
         try:
+            deadline = deadline or Deadline(None)
+            orchestrator = get_orchestrator()
+
             # Search web using DuckDuckGo
             cleaned_query = query.replace('"', '').replace("'", "").strip()
             with DDGS() as ddgs:
                 results = [r for r in ddgs.text(cleaned_query, max_results=num_results)]
-            
-            web_resources = []
-            for result in results:
-                try:
-                    # Rate limiting
-                    time.sleep(0.1)
-                    
-                    # Get webpage content
-                    url = result['href']
-                    headers = {'User-Agent': 'Mozilla/5.0'}
-                    response = requests.get(url, headers=headers, timeout=10)
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # Remove unwanted elements
-                    for tag in soup(['script', 'style', 'nav', 'footer', 'header']):
-                        tag.decompose()
-
-                    # Get relevant content with more semantic tags
-                    content_tags = soup.find_all(['p', 'h1', 'h2', 'h3', 'article', 'section', 'main'])
-                    content = " ".join(tag.get_text(strip=True) for tag in content_tags)
-                    
-                    # Clean and normalize text
-                    content = re.sub(r'\s+', ' ', content)  # Remove extra whitespace
-                    content = re.sub(r'[^\w\s.,!?-]', '', content)  # Keep basic punctuation
-                    content = content[:4096]  # Limit content length
-                    
-                    # Basic relevance check
-                    if not any(term.lower() in content.lower() for term in query.split()):
-                        continue
-
-                    name = result['title']
-                    print(f"Web Resource: {name} - {url}")
-                    
-                    if content.__contains__('404') or content.__contains__('Page not found') or content.__contains__('denied'):
-                        continue
-
-                    # Add to web resources to db for future reference
-                    r = self.add_resource(name, content)
-
-                    print(f"Resource added: {r}")
-                    
-                    web_resources.append({
-                        'name': name,
-                        'content': content,
-                        'url': url,
-                        'tags': r['tags'],
-                        'description': r['description']
-                    })
-                    
-                except requests.RequestException as e:
-                    print(f"Request error for {url}: {str(e)}")
-                    continue
-                except Exception as e:
-                    print(f"Error processing {url}: {str(e)}")
-                    continue
-                    
+
+            web_resources = orchestrator.map_until(
+                lambda result: self._fetch_web_page(query, result), results, deadline,
+                on_late=self._ingest_web_page
+            )
+            # Pages that made the deadline are enriched together, late ones one by one as they come
+            if web_resources:
+                orchestrator.ingest(self._ingest_web_pages, web_resources)
+
             # Format context from web resources
             if web_resources:
                 context = "\n\n".join([
@@ -318,231 +626,375 @@ class OllamaRAG:
             print(f"Error searching web: {str(e)}")
             return "" , []
     
-    def _summarize_previous_conversations(self, prompt : str) -> str:
+    def _get_conversation_history(self, prompt : str) -> str:
         """
-        Retrieves and summarizes the last N conversations with the user.
+        Retrieves the past conversations most relevant to the prompt from the whole history.
 
-        - Extracts key topics, questions, and AI responses.
-        - Ensures the summary is **concise yet informative**.
-        - Provides a structured, easy-to-understand overview.
+        - Uses the full-text and vector indexes instead of summarising the last N turns with the LLM.
+        - Keeps at most `number_of_previous_conversations` turns within `history_token_budget`.
         """
-
-        # **Fetch the last N conversations**
-        conversations = self.db.get_last_n_conversations(self.number_of_previous_conversations)
-
-        # **Format conversations into a structured transcript**
-        conversation_log = "\n".join([
-            f"User: {c[1]}\nAssistant: {c[2]}\n Time : {c[3]}\n" for c in conversations
+        conversations = self.db.search_conversations(prompt, self.number_of_previous_conversations, self.history_token_budget)
+        return "\n".join([
+            f"User: {c['user_input']}\nAssistant: {c['assistant_response']}\n Time : {c['created_at']}\n" for c in conversations
         ])
-
-        # **Optimized Summary Prompt**
-        summary_prompt = f"""
-        You are an AI summarization assistant responsible for condensing past conversations into relevant insights.
-
-        ### User Query:
-        {prompt}
-
-        ### Previous {self.number_of_previous_conversations} Conversations:
-        {conversation_log}
-
-        ### Instructions:
-        - Provide a **concise and detailed** summary of key topics discussed.
-        - Highlight important questions, AI responses, and any unresolved issues.
-        - Ensure the summary is **coherent and well-structured**.
-        - Retain meaningful context while avoiding unnecessary details.
-        - Maintain the chronological order of conversations.
-
-        ### Summary of Conversations:
-        """
-        
-        summary = self._call_ollama(summary_prompt)
-        return summary
     
     def generate_tags_for_resource(self):
         # iterate over all resources in the database if tags are not present then generate tags
-        resources = self.db.resources_with_empty_tags()
-        for resource in resources:
-            tags_prompt = f"""
-            You are an AI assistant responsible for generating relevant tags for a given resource.
-
-            ### Resource Content:
-            {resource[3]}
+        # Streamed with only the columns needed, the database runs in WAL mode so updates can commit mid-stream.
+        # Rows are enriched a batch at a time, missing descriptions are filled in by the same call
+        resources = self.db.iter_resources('id, content', where="tags IS NULL OR tags = ''")
+        batch = []
+        for row in resources:
+            batch.append(row)
+            if len(batch) >= self.enrich_max_items:
+                self._enrich_stored(batch)
+                batch = []
+        if batch:
+            self._enrich_stored(batch)
+
+    def _enrich_stored(self, rows: List[Tuple]) -> None:
+        for (resource_id, _), item in zip(rows, self.enrich_documents([content for _, content in rows])):
+            self.db.update_enrichment(resource_id, item["description"], item["tags"])
+
+
+    def _local_confidence(self, local_results: list, local_queries: int) -> float:
+        """
+        Scores how well this turn's local retrieval covered the query, between 0 and 1.
 
-            ### Instructions:
-            - Provide **3-7 highly relevant** tags that best describe the resource.
-            - Tags should be **short, precise, and meaningful** (e.g., 'Machine Learning', 'Cybersecurity').
-            - If the resource covers multiple topics, include diverse yet related tags.
-            - **Avoid generic words** like "information", "article", or "document".
+        Coverage is the share of sub-queries that matched at least one returned
+        resource, scaled by the best match strength (4 = name match, 1 = content only).
+        """
+        if not local_results or not local_queries:
+            return 0.0
+        matched = {q['query'] for r in local_results for q in r['queries']}
+        coverage = len(matched) / local_queries
+        strength = max(r['relevance'] for r in local_results) / 4
+        return min(1.0, coverage * strength)
+
+    def _should_search_web(self, user_input: str, context: str, local_results: list, local_queries: int) -> Tuple[bool, str, float]:
+        """
+        Decides whether the web stage runs for this turn. Returns (search, reason, local confidence).
+        """
+        if not self.adaptive_web_search:
+            return True, "adaptive mode off", 0.0
+
+        confidence = self._local_confidence(local_results, local_queries)
+        if confidence >= self.web_confidence_threshold:
+            return False, "local retrieval confident", confidence
+
+        # Borderline scores are settled by a one-word classifier call
+        if self.web_classifier and context and confidence >= self.web_confidence_threshold / 2:
+            answer = stripThink(self._call_ollama(WEB_NEEDED_PROMPT.format(context=context, user_input=user_input)))
+            if answer.strip().upper().startswith("NO"):
+                return False, "classifier: local context sufficient", confidence
+            return True, "classifier: web needed", confidence
+
+        return True, "local retrieval not confident", confidence
+
+    def _web_coverage(self, user_input: str, web_context: str) -> float:
+        """Share of the meaningful query terms that appear in the web context."""
+        terms = query_terms(user_input)
+        if not terms:
+            return 1.0
+        return len(terms & term_set(web_context)) / len(terms)
+
+    def _info(self) -> dict:
+        return {
+            "performance": self.performance,
+            "web_search": self.web_search,
+            "model": self.model_name,
+            "context_search": self.context_search,
+            "number_of_searches": self.number_of_searches,
+            "deep_search": self.deep_search,
+            "adaptive_web_search": self.adaptive_web_search,
+            "conversation_memory": self.conversation_memory,
+            "profile": self.profile,
+            "parallel_retrieval": self.parallel_retrieval,
+            "batched_enrichment": self.batched_enrichment,
+            # Since startup, background ingestion of earlier turns included
+            "enrichment_cumulative": dict(self.enrich_stats),
+            "number_of_previous_conversations": self.number_of_previous_conversations,
+            "context_tokens": len(self.ollama_context or [])
+        }
 
-            ### Generated Tags (comma-separated):
-            """
+    def _answer_from_cache(self, user_input: str, cached: dict):
+        """
+        Answers from a stored conversation instead of running the pipeline.
 
-            tags = self._call_ollama(tags_prompt)
-            tags = stripThink(tags)
-            self.db.update_tags(resource[0], tags)
+        Exact matches return the stored answer as is. Semantic matches are refreshed
+        with a single short LLM call when `cache_refresh` is on.
+        """
+        start = time.time()
+        refreshed = cached['match'] != 'exact' and self.cache_refresh
+        if refreshed:
+            response = self._call_ollama(REFRESH_PROMPT.format(
+                cached_input=cached['user_input'],
+                cached_response=cached['assistant_response'],
+                user_input=user_input
+            ), PRIORITY_ANSWER)
+            if self.conversation_memory:
+                self.db.add_conversation(user_input, response)
+        else:
+            response = cached['assistant_response']
+
+        info = self._info()
+        info["cache"] = {
+            "hit": True,
+            "match": cached['match'],
+            "similarity": cached['similarity'],
+            "conversation_id": cached['id'],
+            "cached_at": cached['created_at'],
+            "refreshed": refreshed,
+            "seconds": time.time() - start
+        }
+        return response , [] , info
 
+    def _local_retrieval(self, user_input: str):
+        # Runs on a retrieval thread, returns (context, results, number of sub-queries)
+        return self._get_relevant_context(user_input, self.number_of_searches)
 
-    def chat(self, user_input: str):
-        # Initialize empty context
-        context = ""
-        
-        # Get relevant context from database only if enabled
-        if self.context_search:
-            context = self._get_relevant_context(user_input, self.number_of_searches)
-            print(f"Context: {context}")
-            print("-"*15)
+    def _web_retrieval(self, user_input: str, deadline: Deadline, partial: Optional[dict] = None):
+        """
+        The web stage: query generation, search, optional deep search and summary.
 
-        if self.web_search:
-            # create query for web search
-            query_for_web = f"""
-            Generate an effective and precise search query that can be used to find high-quality, relevant, and up-to-date information from the web. 
-            The query should be optimized for search engines like Google and focus on retrieving authoritative sources, blogs, research papers, or forums.
+        Runs on a retrieval thread. Page fetches get `WEB_FETCH_SHARE` of the time left,
+        steps that would start after `deadline` are skipped: no deep search, and the raw
+        page text is used instead of a summary. Fetched pages are also put in `partial`
+        so the caller can use them if the stage as a whole misses its deadline.
+        Returns (context_from_web, resources, timings, decision info).
+        """
+        partial = {} if partial is None else partial
+        timings = {}
+        info = {}
+        web_start = time.time()
+        lap = web_start
 
-            Context: {user_input}
+        # create query for web search
+        query_for_web = WEB_QUERY_PROMPT.format(user_input=user_input)
 
-            Ensure the query:
-            - Uses relevant keywords and phrases.
-            - Avoids unnecessary words or ambiguity.
-            - Targets reputable sources for the best information.
-            - Is structured concisely for accurate search results.
+        start = time.time()
+        query_for_web = self._call_ollama(query_for_web)
+        query_for_web = stripThink(query_for_web)
+        
+        print(f"-"*15)
+        print("Query for web: ", query_for_web)
+        print(f"-"*15)
 
-            Provide only the search query without additional explanation.
-            """
+        print("Average time for word generation: ", (time.time() - start) / max(1, len(query_for_web.split())))
+        print(f"-"*15)
+        lap = self._lap(timings, "web_query", lap)
+
+        context_from_web , resources = self._find_resources_on_web(query_for_web, num_results=self.number_of_searches, deadline=deadline.fraction(WEB_FETCH_SHARE))
+        partial.update(context_from_web=context_from_web, resources=list(resources))
+        lap = self._lap(timings, "web_search", lap)
+
+        # Skip the deep search once the first results already cover the query
+        if self.deep_search and self.adaptive_web_search:
+            coverage = self._web_coverage(user_input, context_from_web)
+            info["web_coverage"] = coverage
+            if coverage >= self.deep_search_coverage:
+                info["deep_search"] = "skipped"
+        if self.deep_search and info.get("deep_search") != "skipped" and deadline.expired():
+            info["deep_search"] = "deadline"
+        if self.deep_search and "deep_search" not in info:
+            info["deep_search"] = "ran"
+            web_search_deep = DEEP_SEARCH_PROMPT.format(user_input=user_input, context_from_web=context_from_web)
+
+            addition_web_query = self._call_ollama(web_search_deep)
+            addition_web_query = stripThink(addition_web_query)
 
-            start = time.time()
-            query_for_web = self._call_ollama(query_for_web)
-            query_for_web = stripThink(query_for_web)
-            
-            print(f"-"*15)
-            print("Query for web: ", query_for_web)
             print(f"-"*15)
-
-            print("Average time for word generation: ", (time.time() - start) / len(query_for_web.split()))
+            print("Additional Query for web: ", addition_web_query)
             print(f"-"*15)
 
-            context_from_web , resources = self._find_resources_on_web(query_for_web, num_results=self.number_of_searches)
-
-            if self.deep_search:
-                web_search_deep = f"""
-                Based on the original user query: "{user_input}" 
-                And the initial web search results: {context_from_web}
-
-                Generate ONE additional search query following these rules:
-                1. Focus on key concepts or topics that need more detail
-                2. Identify gaps in the current search results
-                3. Use specific, relevant keywords
-                4. Keep the query under 10 words
-                5. Exclude generic terms
-                6. Format: clear, concise search terms
-                
-                Return ONLY the search query without explanation.
-                """
-
-                addition_web_query = self._call_ollama(web_search_deep)
-                addition_web_query = stripThink(addition_web_query)
-
-                print(f"-"*15)
-                print("Additional Query for web: ", addition_web_query)
-                print(f"-"*15)
-
-                additional_web_context, additional_resources = self._find_resources_on_web(addition_web_query, num_results=self.number_of_searches)
-                context_from_web += additional_web_context
-                resources += additional_resources
-
-            # summarize the context from web
-            web_summary_prompt = f"""
-            You are an advanced AI assistant designed to extract key information from provided sources.
-
-            ## **Task:**
-            Summarize the most relevant and important insights from the retrieved web content to help answer the following user query:
-
-            ### **User Query:**
-            {user_input}
-
-            ## **Web Content:**
-            {context_from_web}
-
-            ## **Instructions:**
-            1. **Extract Key Insights:** Identify the most valuable information relevant to answering the user’s query.
-            2. **Filter Out Irrelevant Details:** Remove redundant or off-topic content.
-            3. **Summarize Clearly and Concisely:** Provide a structured summary in a few paragraphs or bullet points.
-            4. **Prioritize Recent & Reliable Sources:** Highlight the most authoritative and up-to-date information.
-            5. **Maintain Neutrality:** Present the summary in an objective manner without adding opinions.
-
-            ## **Output Format:**
-            Provide a structured summary that is easy to understand and directly useful in answering the user’s query.
-            """
+            additional_web_context, additional_resources = self._find_resources_on_web(addition_web_query, num_results=self.number_of_searches, deadline=deadline.fraction(WEB_FETCH_SHARE))
+            context_from_web += additional_web_context
+            resources += additional_resources
+            partial.update(context_from_web=context_from_web, resources=list(resources))
+            lap = self._lap(timings, "deep_search", lap)
+
+        # summarize the context from web
+        if deadline.expired():
+            info["web_summary"] = "deadline"
+        elif context_from_web:
+            web_summary_prompt = WEB_SUMMARY_PROMPT.format(user_input=user_input, context_from_web=context_from_web)
             start = time.time()
             context_from_web = self._call_ollama(web_summary_prompt)
-            print("Average time for word generation: ", (time.time() - start) / len(context_from_web.split()))
+            print("Average time for word generation: ", (time.time() - start) / max(1, len(context_from_web.split())))
             print(f"-"*15)
-        
-            # Update RAG prompt to include context only if it exists
-            rag_prompt = f"""
-            You are an intelligent assistant designed to provide accurate and context-aware responses. 
+            lap = self._lap(timings, "web_summary", lap)
 
-            {f'## **Context Information:**\n{context}\n' if context else ''}
+        # Running average of the web stage, used to estimate what a skip saves
+        web_seconds = time.time() - web_start
+        info["web_seconds"] = web_seconds
+        if OllamaRAG.web_stage_seconds is None:
+            OllamaRAG.web_stage_seconds = web_seconds
+        else:
+            OllamaRAG.web_stage_seconds = 0.8 * OllamaRAG.web_stage_seconds + 0.2 * web_seconds
 
-            ## **Web Search Results:**
-            {context_from_web}
+        return context_from_web, resources, timings, info
 
-            ## **User Conversation History (Last {self.number_of_previous_conversations} interactions):**
-            {self._summarize_previous_conversations(user_input)}
+    def chat(self, user_input: str):
+        if not self.profile:
+            return self._chat(user_input)
+
+        # cProfile only sees the calling thread, so profiled turns retrieve in it instead of on the pool
+        with get_orchestrator().inline():
+            (response, resources, info), report = profile_call(self._chat, user_input, label="chat")
+        print(report["summary"])
+        info["profile"] = report
+        return response , resources , info
 
-            ### **Instructions:**
-            1. **Synthesize Information:** Combine relevant details from the provided context, web search results, and past conversations.
-            2. **Prioritize Relevance:** Focus on the most important and up-to-date facts to answer the question accurately.
-            3. **Ensure Clarity & Concisiveness:** The response should be clear, well-structured, and concise while covering key points.
-            4. **Avoid Redundancy:** If a previous conversation already addressed this, summarize the past response and add new insights if necessary.
-            5. **Cite Sources If Applicable:** If information is derived from web search results, indicate it subtly.
+    def _lap(self, timings: dict, stage: str, since: float) -> float:
+        # Adds the time since `since` to a stage and returns the new starting point
+        now = time.time()
+        timings[stage] = timings.get(stage, 0.0) + now - since
+        return now
+
+    def _chat(self, user_input: str):
+        turn_start = time.time()
+        timings = {}
+        self.llm_stats = {"calls": 0, "queue_seconds": 0.0, "coalesced": 0}
+        lap = turn_start
+
+        if self.answer_cache:
+            cached = self.db.find_cached_answer(user_input, self.cache_threshold, self.cache_max_age_hours)
+            lap = self._lap(timings, "cache_lookup", lap)
+            if cached:
+                print(f"Answer cache hit ({cached['match']}, similarity {cached['similarity']:.2f})")
+                response, resources, info = self._answer_from_cache(user_input, cached)
+                self._lap(timings, "cache_answer", lap)
+                timings["total"] = time.time() - turn_start
+                info["timings"] = timings
+                info["llm"] = dict(self.llm_stats)
+                return response , resources , info
 
-            ### **User Query:**
-            {user_input}
+        # Initialize empty context
+        context = ""
+        context_from_web = ""
+        resources = []
+        local_results = []
+        local_queries = 0
+        orchestrator = get_orchestrator()
+        retrieval_start = time.time()
+
+        # Adaptive mode decides from the local results, so only then does the web wait for them
+        web_upfront = self.web_search and self.parallel_retrieval and not self.adaptive_web_search
+        sources = {}
+        if self.context_search:
+            sources["local"] = (lambda: self._local_retrieval(user_input), self.local_deadline_seconds)
+        # Filled by the web stage as pages arrive, used if it misses its deadline
+        web_partial = {}
+        if web_upfront:
+            sources["web"] = (lambda: self._web_retrieval(user_input, Deadline(self.web_deadline_seconds), web_partial), self.web_deadline_seconds)
+        if not self.parallel_retrieval:
+            # Sequential mode still bounds each source by its deadline
+            retrieved = {name: orchestrator.run({name: source})[name] for name, source in sources.items()}
+        else:
+            retrieved = orchestrator.run(sources)
+        retrieval_status = {name: r["status"] for name, r in retrieved.items()}
 
-            ### **Your Response:**
-            """
+        # Get relevant context from database only if enabled
+        if "local" in retrieved:
+            timings["local_retrieval"] = retrieved["local"]["seconds"]
+            if retrieved["local"]["status"] == "ok":
+                context, local_results, local_queries = retrieved["local"]["result"]
+                print(f"Context: {context}")
+                print("-"*15)
+            else:
+                print(f"Local retrieval {retrieved['local']['status']}, answering without it")
+        lap = time.time()
+
+        use_web = False
+        web_decision = {"mode": "adaptive" if self.adaptive_web_search else "always"}
+        if self.web_search:
+            use_web, reason, confidence = self._should_search_web(user_input, context, local_results, local_queries)
+            web_decision.update({"searched": use_web, "reason": reason, "local_confidence": confidence})
+            if not use_web:
+                web_decision["estimated_savings_s"] = OllamaRAG.web_stage_seconds
+            print(f"Web search: {use_web} ({reason}, confidence {confidence:.2f})")
+            lap = self._lap(timings, "web_decision", lap)
+
+        if use_web and "web" not in retrieved:
+            retrieved.update(orchestrator.run({
+                "web": (lambda: self._web_retrieval(user_input, Deadline(self.web_deadline_seconds), web_partial), self.web_deadline_seconds)
+            }))
+            retrieval_status["web"] = retrieved["web"]["status"]
+
+        if use_web:
+            web = retrieved["web"]
+            web_decision["status"] = web["status"]
+            if web["status"] == "ok":
+                context_from_web, resources, web_timings, web_info = web["result"]
+                timings.update(web_timings)
+                web_decision.update(web_info)
+            elif web_partial.get("context_from_web"):
+                # Summary did not make it in time, answer from the raw pages fetched so far
+                context_from_web = web_partial["context_from_web"]
+                resources = web_partial["resources"]
+                web_decision["status"] = "partial"
+                print(f"Web retrieval {web['status']}, using {len(resources)} raw pages")
+            else:
+                # Pages that arrive later are still stored in the background
+                print(f"Web retrieval {web['status']}, answering without it")
+                use_web = False
+            lap = time.time()
+
+        timings["retrieval"] = time.time() - retrieval_start
+
+        history = self._get_conversation_history(user_input) if self.conversation_memory else ""
+        lap = self._lap(timings, "history", lap)
+
+        if use_web:
+            # Update RAG prompt to include context only if it exists
+            rag_prompt = RAG_WEB_PROMPT.format(
+                context_section=f'## **Context Information:**\n{context}\n' if context else '',
+                context_from_web=context_from_web,
+                history=history,
+                user_input=user_input
+            )
         else:
             # Create RAG prompt without web search results
-            rag_prompt = f"""
-            You are an intelligent assistant designed to provide accurate and context-aware responses. 
-
-            {f'## **Context Information From Database:**\n{context}\n' if context else ''}
-
-            ## **User Conversation History (Last {self.number_of_previous_conversations} interactions):**
-            {self._summarize_previous_conversations(user_input)}
-
-            ### **Instructions:**
-            1. **Synthesize Information:** Combine relevant details from the provided context and past conversations.
-            2. **Prioritize Relevance:** Focus on the most important facts to answer the question accurately.
-            3. **Ensure Clarity & Concisiveness:** The response should be clear, well-structured, and concise while covering key points.
-            4. **Avoid Redundancy:** If a previous conversation already addressed this, summarize the past response and add new insights if necessary.
-
-            ### **User Query:**
-            {user_input}
-
-            ### **Your Response:**
-            """
+            rag_prompt = RAG_PROMPT.format(
+                context_section=f'## **Context Information From Database:**\n{context}\n' if context else '',
+                history=history,
+                user_input=user_input
+            )
 
             resources = []
 
         # Get response from Ollama
         start = time.time()
-        response = self._call_ollama(rag_prompt)
+        result = self._generate(rag_prompt, context=self._reusable_context(rag_prompt), priority=PRIORITY_ANSWER)
+        response = result['response']
+
+        # Keep the KV-context for the next turn, start over once it outgrows the window
+        self.ollama_context = result.get('context')
+        if self.ollama_context and len(self.ollama_context) > self.max_context_tokens:
+            self.ollama_context = None
         # response = stripThink(response)
         print("Average time for word generation: ", (time.time() - start) / len(response.split()))
+        lap = self._lap(timings, "generation", lap)
         
         # Store conversation in database
-        self.db.add_conversation(user_input, response)
-
-        info = {
-            "performance": self.performance,
-            "web_search": self.web_search,
-            "model": self.model_name,
-            "context_search": self.context_search,
-            "number_of_searches": self.number_of_searches,
-            "deep_search": self.deep_search,
-            "number_of_previous_conversations": self.number_of_previous_conversations
+        if self.conversation_memory:
+            self.db.add_conversation(user_input, response)
+        self._lap(timings, "store", lap)
+        timings["total"] = time.time() - turn_start
+
+        info = self._info()
+        info["cache"] = {"hit": False}
+        info["web_decision"] = web_decision
+        info["local_resources"] = [
+            {"id": r['id'], "name": r['name'], "rrf_score": r['rrf_score']} for r in local_results
+        ]
+        info["retrieval"] = {
+            "parallel": self.parallel_retrieval and not self.profile,
+            "status": retrieval_status,
+            "orchestrator": orchestrator.stats()
         }
+        info["timings"] = timings
+        info["llm"] = dict(self.llm_stats)
         return response , resources , info
 
 def main():
@@ -562,7 +1014,7 @@ def main():
         if user_input.lower() == 'quit':
             break
             
-        response = rag.chat(user_input)
+        response, resources, info = rag.chat(user_input)
         print(f"Assistant: {response}")
 
 if __name__ == "__main__":
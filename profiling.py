@@ -0,0 +1,115 @@
+import io
+import os
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime
+
+# Set RAG_PROFILE=1 to profile every chat turn, reports go to RAG_PROFILE_DIR
+PROFILE_ENV = "RAG_PROFILE"
+PROFILE_DIR_ENV = "RAG_PROFILE_DIR"
+DEFAULT_PROFILE_DIR = "profiles"
+
+# cProfile (one active profiler per process since 3.12) and tracemalloc are process wide,
+# so profiled calls run one at a time. Re-entrant for nested calls on the same thread
+_profile_lock = threading.RLock()
+
+
+def profiling_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, "").strip().lower() in ("1", "true", "yes", "on")
+
+
+def profile_dir() -> str:
+    return os.environ.get(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR)
+
+
+def profile_call(fn, *args, out_dir: str = None, top_n: int = 20, label: str = "turn", **kwargs):
+    """
+    Runs `fn(*args, **kwargs)` under cProfile and tracemalloc.
+
+    Writes `<label>-<timestamp>.prof` (loadable with pstats or snakeviz) and a text report
+    next to it. Returns (result, report) where report holds the file paths, wall time,
+    peak traced memory, the top-N functions by cumulative time, the top-N allocation
+    sites and a printable summary. Only the calling thread is profiled. Concurrent
+    profiled calls wait for each other, the wait is not part of the report.
+    """
+    with _profile_lock:
+        return _profile_call(fn, *args, out_dir=out_dir, top_n=top_n, label=label, **kwargs)
+
+
+def _profile_call(fn, *args, out_dir: str = None, top_n: int = 20, label: str = "turn", **kwargs):
+    out_dir = out_dir or profile_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    stem = os.path.join(out_dir, f"{label}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}")
+
+    # Nested calls reuse the outer trace instead of resetting it
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    else:
+        tracemalloc.reset_peak()
+
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    try:
+        result = profiler.runcall(fn, *args, **kwargs)
+    finally:
+        wall_seconds = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+    profiler.dump_stats(stem + ".prof")
+
+    stats = pstats.Stats(profiler)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE)
+    hot_functions = []
+    for func in stats.fcn_list[:top_n]:
+        calls, primitive_calls, tottime, cumtime, _ = stats.stats[func]
+        filename, line, name = func
+        hot_functions.append({
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "tottime": tottime,
+            "cumtime": cumtime
+        })
+
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+    top_allocations = [
+        {
+            "location": f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+            "size_bytes": stat.size,
+            "count": stat.count
+        }
+        for stat in snapshot.statistics("lineno")[:top_n]
+    ]
+
+    lines = [f"Wall time: {wall_seconds:.3f}s, peak traced memory: {peak / 1024 / 1024:.1f} MiB", "", "Hot functions (cumulative):"]
+    lines += [f"  {f['cumtime']:8.3f}s {f['tottime']:8.3f}s {f['calls']:>8} {f['function']}" for f in hot_functions]
+    lines += ["", "Top allocations (live at end of turn):"]
+    lines += [f"  {a['size_bytes'] / 1024:10.1f} KiB {a['count']:>8} {a['location']}" for a in top_allocations]
+    summary = "\n".join(lines)
+
+    with open(stem + ".txt", "w") as f:
+        f.write(summary + "\n\n")
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(top_n * 3)
+        f.write(stream.getvalue())
+
+    report = {
+        "prof_file": stem + ".prof",
+        "report_file": stem + ".txt",
+        "wall_seconds": wall_seconds,
+        "peak_memory_bytes": peak,
+        "hot_functions": hot_functions,
+        "top_allocations": top_allocations,
+        "summary": summary
+    }
+    return result, report
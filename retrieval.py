@@ -0,0 +1,178 @@
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Optional, Iterable, List
+
+
+class Deadline:
+    """Absolute point in time a stage has to finish by. `None` seconds means no limit."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.at = None if seconds is None else time.time() + seconds
+
+    def fraction(self, share: float) -> "Deadline":
+        """A deadline that ends after `share` of the time this one has left."""
+        remaining = self.remaining()
+        return Deadline(None if remaining is None else remaining * share)
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else max(0.0, self.at - time.time())
+
+    def expired(self) -> bool:
+        return self.at is not None and time.time() >= self.at
+
+
+class RetrievalOrchestrator:
+    """
+    Runs retrieval sources concurrently on a shared thread pool, each with its own deadline.
+
+    Whatever has finished by the deadline is returned, sources still running are left to
+    finish on their own and their results are handed to an optional `on_late` callback.
+    Fan-out work started by a source (page fetches in `map_until`) gets its own pool, so a
+    source never waits for a slot that other sources are holding. Ingestion work (LLM
+    descriptions and tags, DB inserts) runs on a separate, smaller pool so it never takes
+    a retrieval slot.
+
+    Inside `inline()` the calling thread runs the sources itself, one after the other, so
+    a profiler attached to it sees the retrieval work. Deadlines are not enforced then.
+    """
+
+    def __init__(self, max_workers: int = 16, ingest_workers: int = 2, fetch_workers: int = 16):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="retrieval")
+        self.fetch_pool = ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix="fetch")
+        self.ingest_pool = ThreadPoolExecutor(max_workers=ingest_workers, thread_name_prefix="ingest")
+        self._lock = threading.Lock()
+        self._stats = {"timeouts": 0, "errors": 0, "late_results": 0, "ingested": 0, "ingest_errors": 0}
+        self._local = threading.local()
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    @contextmanager
+    def inline(self):
+        """Runs `run` and `map_until` calls made by this thread in the thread itself."""
+        previous = getattr(self._local, "inline", False)
+        self._local.inline = True
+        try:
+            yield self
+        finally:
+            self._local.inline = previous
+
+    def _inline(self) -> bool:
+        return getattr(self._local, "inline", False)
+
+    def _late(self, future, on_late: Optional[Callable]) -> None:
+        # Runs on the worker thread once a timed out task completes
+        if future.cancelled() or future.exception() is not None:
+            return
+        self._count("late_results")
+        if on_late is not None:
+            self.ingest(on_late, future.result())
+
+    def run(self, sources: dict) -> dict:
+        """
+        Runs `sources` ({name: (fn, deadline seconds or None)}) concurrently and waits for
+        each until its deadline. Returns {name: {"status", "result", "seconds"}} where status
+        is "ok", "timeout" or "error"; result is None unless the source finished in time.
+        """
+        started = time.time()
+        if self._inline():
+            results = {}
+            for name, (fn, _) in sources.items():
+                try:
+                    results[name] = {"status": "ok", "result": fn(), "seconds": time.time() - started}
+                except Exception as e:
+                    self._count("errors")
+                    print(f"Retrieval source {name} failed: {str(e)}")
+                    results[name] = {"status": "error", "result": None, "seconds": time.time() - started, "error": str(e)}
+            return results
+
+        futures = {name: (self.pool.submit(fn), Deadline(seconds)) for name, (fn, seconds) in sources.items()}
+        results = {}
+        for name, (future, deadline) in futures.items():
+            done, _ = wait([future], timeout=deadline.remaining())
+            if not done:
+                self._count("timeouts")
+                future.add_done_callback(lambda f: self._late(f, None))
+                results[name] = {"status": "timeout", "result": None, "seconds": time.time() - started}
+            elif future.exception() is not None:
+                self._count("errors")
+                print(f"Retrieval source {name} failed: {str(future.exception())}")
+                results[name] = {"status": "error", "result": None, "seconds": time.time() - started, "error": str(future.exception())}
+            else:
+                results[name] = {"status": "ok", "result": future.result(), "seconds": time.time() - started}
+        return results
+
+    def map_until(self, fn: Callable, items: Iterable, deadline: Deadline, on_late: Optional[Callable] = None) -> List:
+        """
+        Calls `fn` on every item concurrently and returns the non-None results that arrived
+        before `deadline`, in input order. Results that arrive later are passed to `on_late`
+        on the ingestion pool instead of being dropped.
+        """
+        if self._inline():
+            results = []
+            for item in items:
+                try:
+                    result = fn(item)
+                except Exception as e:
+                    self._count("errors")
+                    print(f"Retrieval task failed: {str(e)}")
+                    continue
+                if result is not None:
+                    results.append(result)
+            return results
+
+        futures = [self.fetch_pool.submit(fn, item) for item in items]
+        pending = set(futures)
+        while pending and not deadline.expired():
+            _, pending = wait(pending, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+
+        for future in pending:
+            self._count("timeouts")
+            future.add_done_callback(lambda f: self._late(f, on_late))
+
+        results = []
+        for future in futures:
+            if future in pending:
+                continue
+            if future.exception() is not None:
+                self._count("errors")
+                print(f"Retrieval task failed: {str(future.exception())}")
+            elif future.result() is not None:
+                results.append(future.result())
+        return results
+
+    def ingest(self, fn: Callable, *args, **kwargs):
+        """Queues background ingestion work, errors are logged and counted."""
+        def run():
+            try:
+                fn(*args, **kwargs)
+                self._count("ingested")
+            except Exception as e:
+                self._count("ingest_errors")
+                print(f"Background ingestion error: {str(e)}")
+        try:
+            return self.ingest_pool.submit(run)
+        except RuntimeError:
+            # The pools are shut down at interpreter exit, late pages are dropped then
+            self._count("ingest_errors")
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+_orchestrator = None
+_orchestrator_lock = threading.Lock()
+
+
+def get_orchestrator(**kwargs) -> RetrievalOrchestrator:
+    """Returns the process-wide orchestrator, created with `kwargs` on first use."""
+    global _orchestrator
+    with _orchestrator_lock:
+        if _orchestrator is None:
+            _orchestrator = RetrievalOrchestrator(**kwargs)
+        return _orchestrator
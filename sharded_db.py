@@ -0,0 +1,262 @@
+import os
+import zlib
+import threading
+import multiprocessing
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Tuple, Callable, Union, Iterator, Sequence
+from RAG_DB import RAGDB, RESOURCE_COLUMNS, CONVERSATION_COLUMNS, ITER_BATCH_SIZE
+
+# One RAGDB per shard path inside each worker process
+_WORKER_DBS = {}
+
+
+def _run_on_shard(path: str, method: str, args: tuple, kwargs: dict):
+    db = _WORKER_DBS.get(path)
+    if db is None:
+        db = _WORKER_DBS[path] = RAGDB(path)
+    return getattr(db, method)(*args, **kwargs)
+
+
+class ShardedRAGDB:
+    """
+    Facade over several RAGDB files with the same interface as RAGDB.
+
+    Resources live in shards, conversations in a single primary database. Searches fan
+    out to every shard on a process pool and the results are merged by score. Resource
+    ids returned by the facade are "shard:id" strings so they stay unique across shards.
+    """
+
+    def __init__(self, shards: Union[dict, List[str]], conversations_path: str = "ragV2.db", router: Union[str, Callable] = "hash", max_workers: Optional[int] = None):
+        self.primary = RAGDB(conversations_path)
+        self.db_path = conversations_path
+        self.router = router
+        self.max_workers = max_workers or os.cpu_count()
+        self.shards = {}
+        self._lock = threading.Lock()
+        self._pool = None
+        self.new_resources = []
+        self.new_conversations = self.primary.new_conversations
+
+        if isinstance(shards, dict):
+            for name, path in shards.items():
+                self.attach_shard(name, path)
+        else:
+            for path in shards:
+                self.attach_shard(os.path.splitext(os.path.basename(path))[0], path)
+
+    # Shard management
+
+    def attach_shard(self, name: str, path: str) -> None:
+        db = RAGDB(path)
+        with self._lock:
+            self.shards[name] = db
+
+    def detach_shard(self, name: str) -> Optional[RAGDB]:
+        with self._lock:
+            return self.shards.pop(name, None)
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def _snapshot(self) -> List[Tuple[str, RAGDB]]:
+        with self._lock:
+            return sorted(self.shards.items())
+
+    def _route(self, name: str, content: str, description: str, tags: str) -> str:
+        shards = [n for n, _ in self._snapshot()]
+        if not shards:
+            raise ValueError("No shards attached")
+        if callable(self.router):
+            return self.router(name, content, description, tags)
+        if self.router == "topic":
+            # First tag decides the shard, so one topic stays together
+            key = (tags or '').split(',')[0].strip().lower() or name
+        else:
+            key = name
+        return shards[zlib.crc32(key.encode('utf-8')) % len(shards)]
+
+    def _split_id(self, resource_id) -> Tuple[RAGDB, int]:
+        shard, _, local_id = str(resource_id).rpartition(':')
+        with self._lock:
+            if not shard and len(self.shards) == 1:
+                return next(iter(self.shards.values())), int(local_id)
+            return self.shards[shard], int(local_id)
+
+    def _fan_out(self, method: str, *args, **kwargs) -> List[Tuple[str, object]]:
+        shards = self._snapshot()
+        if len(shards) <= 1:
+            return [(name, _run_on_shard(db.db_path, method, args, kwargs)) for name, db in shards]
+
+        with self._lock:
+            if self._pool is None:
+                # Sized from max_workers, not from the shards attached so far: with spawn the worker
+                # processes start on demand, so shards attached later still get their own worker.
+                # Forking this process is unsafe, the gateway, orchestrator and compaction threads run in it
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            pool = self._pool
+        futures = [(name, pool.submit(_run_on_shard, db.db_path, method, args, kwargs)) for name, db in shards]
+
+        results = []
+        for name, future in futures:
+            try:
+                results.append((name, future.result()))
+            except Exception as e:
+                print(f"Search error on shard {name}: {str(e)}")
+        return results
+
+    def _merge(self, results: List[Tuple[str, object]], score_key: str, n_results: int) -> list:
+        merged = []
+        for name, rows in results:
+            for row in rows or []:
+                row['shard'] = name
+                if 'id' in row:
+                    row['id'] = f"{name}:{row['id']}"
+                merged.append(row)
+        return sorted(merged, key=lambda x: float(x[score_key]), reverse=True)[:n_results]
+
+    # Resources
+
+    def add_resource(self, name: str, content: str, description: str , tags : str, source: str = "manual", shard: Optional[str] = None) -> str:
+        shard = shard or self._route(name, content, description, tags)
+        with self._lock:
+            db = self.shards[shard]
+        local_id = db.add_resource(name, content, description, tags, source)
+        self.new_resources.append({
+            "name": name,
+            "content": content,
+            "description": description,
+            "tags": tags,
+            "shard": shard
+        })
+        return f"{shard}:{local_id}"
+
+    def update_tags(self, resource_id, tags: str) -> None:
+        db, local_id = self._split_id(resource_id)
+        db.update_tags(local_id, tags)
+
+    def update_enrichment(self, resource_id, description: str, tags: str) -> None:
+        db, local_id = self._split_id(resource_id)
+        db.update_enrichment(local_id, description, tags)
+
+    def resources_with_empty_tags(self) -> List[Tuple]:
+        return list(self.iter_resources(where="tags IS NULL OR tags = ''"))
+
+    def get_resource(self, resource_id) -> Optional[Tuple]:
+        db, local_id = self._split_id(resource_id)
+        return db.get_resource(local_id)
+
+    def get_all_resources(self) -> List[Tuple]:
+        return list(self.iter_resources())
+
+    def iter_batches(self, table: str, columns: Union[str, Sequence[str], None] = None, where: Optional[str] = None, params: Sequence = (),
+                     batch_size: int = ITER_BATCH_SIZE, **kwargs) -> Iterator[list]:
+        """Resources come from every shard with "shard:id" ids, conversations from the primary database."""
+        if table == 'conversations':
+            yield from self.primary.iter_batches(table, columns, where, params, batch_size=batch_size, **kwargs)
+            return
+        if table != 'resources':
+            raise ValueError(f"Unknown table: {table}")
+        rows = self.iter_resources(columns or RESOURCE_COLUMNS, where, params, batch_size=batch_size, **kwargs)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def iter_resources(self, columns: Union[str, Sequence[str]] = RESOURCE_COLUMNS, where: Optional[str] = None, params: Sequence = (),
+                       row_factory: Optional[Callable] = None, limit: Optional[int] = None, offset: int = 0, **kwargs) -> Iterator:
+        """Streams the resources of every shard in turn, an `id` column is rewritten to "shard:id"."""
+        def rows():
+            for name, db in self._snapshot():
+                def factory(cursor, row, name=name):
+                    row = tuple(f"{name}:{value}" if d[0] == 'id' else value for d, value in zip(cursor.description, row))
+                    return row_factory(cursor, row) if row_factory else row
+                yield from db.iter_resources(columns, where, params, row_factory=factory, **kwargs)
+
+        # Limit and offset apply to the combined stream, not to each shard
+        return islice(rows(), offset, None if limit is None else offset + limit)
+
+    def iter_conversations(self, columns: Union[str, Sequence[str]] = CONVERSATION_COLUMNS, where: Optional[str] = None, params: Sequence = (), **kwargs) -> Iterator:
+        return self.primary.iter_conversations(columns, where, params, **kwargs)
+
+    def count_rows(self, table: str, where: Optional[str] = None, params: Sequence = ()) -> int:
+        if table == 'conversations':
+            return self.primary.count_rows(table, where, params)
+        return sum(db.count_rows(table, where, params) for _, db in self._snapshot())
+
+    def search_resources(self, query: str, n_results: int = 8) -> list:
+        return self._merge(self._fan_out('search_resources', query, n_results), 'relevance', n_results)
+
+    def search_resources_multi(self, queries: List[str], n_results: int = 8, per_query: int = 8, rrf_k: int = 60, touch: bool = True) -> list:
+        # A shard's RRF score only reflects its local ranks, so shards return their per-query
+        # candidates with raw relevance and the fusion runs once over the global ranking
+        queries = list(queries)
+        results = self._fan_out('search_resources_multi', queries, len(queries) * per_query, per_query, rrf_k, False)
+
+        entries = {}
+        candidates = {}
+        for name, rows in results:
+            for row in rows or []:
+                gid = f"{name}:{row['id']}"
+                entries[gid] = dict(row, id=gid, shard=name, local_id=row['id'], relevance=0, rrf_score=0.0, queries=[])
+                for q in row['queries']:
+                    candidates.setdefault(q['query'], []).append((-q['relevance'], name, q['rank'], gid))
+
+        for query, ranked in candidates.items():
+            for rank, (neg_relevance, _, _, gid) in enumerate(sorted(ranked)[:per_query], start=1):
+                entry = entries[gid]
+                entry['rrf_score'] += 1.0 / (rrf_k + rank)
+                entry['relevance'] = max(entry['relevance'], -neg_relevance)
+                entry['queries'].append({'query': query, 'rank': rank, 'relevance': -neg_relevance})
+
+        fused = sorted((e for e in entries.values() if e['queries']), key=lambda x: (-x['rrf_score'], x['id']))[:n_results]
+
+        touched = {}
+        for entry in fused:
+            touched.setdefault(entry['shard'], []).append(entry.pop('local_id'))
+        with self._lock:
+            dbs = dict(self.shards)
+        if touch:
+            for name, ids in touched.items():
+                dbs[name].touch_resources(ids)
+        return fused
+
+    def _search_resources_new(self, query: str, n_results: int = 3, content_length : int = 2048) -> list:
+        return self._merge(self._fan_out('_search_resources_new', query, n_results, content_length), 'score', n_results)
+
+    # Retention runs per shard, each file is compacted on its own
+
+    def compact(self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None, web_ttl_days: Optional[float] = None) -> dict:
+        # Limits apply to every shard separately
+        return {name: db.compact(max_rows, max_bytes, web_ttl_days) for name, db in self._snapshot()}
+
+    def start_compaction(self, interval_seconds: float = 3600, **policy) -> None:
+        for _, db in self._snapshot():
+            db.start_compaction(interval_seconds, **policy)
+
+    def stop_compaction(self) -> None:
+        for _, db in self._snapshot():
+            db.stop_compaction()
+
+    # Conversations stay in the primary database
+
+    def add_conversation(self, user_input: str, assistant_response: str) -> int:
+        return self.primary.add_conversation(user_input, assistant_response)
+
+    def get_conversation(self, conversation_id: int) -> Optional[Tuple]:
+        return self.primary.get_conversation(conversation_id)
+
+    def get_all_conversations(self) -> List[Tuple]:
+        return self.primary.get_all_conversations()
+
+    def get_last_n_conversations(self, n: int) -> List[Tuple]:
+        return self.primary.get_last_n_conversations(n)
+
+    def find_cached_answer(self, user_input: str, threshold: float = 0.92, max_age_hours: Optional[float] = None) -> Optional[dict]:
+        return self.primary.find_cached_answer(user_input, threshold, max_age_hours)
+
+    def search_conversations(self, query: str, k: int = 8, token_budget: int = 1500, rrf_k: int = 60, min_similarity: float = 0.3) -> list:
+        return self.primary.search_conversations(query, k, token_budget, rrf_k, min_similarity)
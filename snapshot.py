@@ -0,0 +1,185 @@
+import os
+import sqlite3
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from typing import Tuple
+from RAG_DB import RAGDB
+from vectors import VECTOR_DIM, normalize_text, embed_text
+from tokenizer import TOKENIZER_VERSION
+
+RESOURCES_FILE = "resources.parquet"
+CONVERSATIONS_FILE = "conversations.parquet"
+
+# Resource ids are only informational, import assigns new ones. A ShardedRAGDB exports "shard:id" strings
+RESOURCES_SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("name", pa.string()),
+    ("description", pa.string()),
+    ("content", pa.string()),
+    ("created_at", pa.string()),
+    ("tags", pa.string()),
+    ("source", pa.string()),
+    ("last_accessed", pa.string()),
+    ("hit_count", pa.int64()),
+])
+
+CONVERSATIONS_SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("user_input", pa.string()),
+    ("assistant_response", pa.string()),
+    ("created_at", pa.string()),
+    ("normalized_input", pa.string()),
+    ("input_vector", pa.list_(pa.float32(), VECTOR_DIM)),
+]).with_metadata({"tokenizer_version": str(TOKENIZER_VERSION)})
+
+
+def _vector_array(blobs: list, texts: list) -> pa.FixedSizeListArray:
+    # Missing vectors are computed on the fly so the column never holds nulls
+    flat = np.concatenate([
+        np.frombuffer(blob, dtype=np.float32) if blob else embed_text(text)
+        for blob, text in zip(blobs, texts)
+    ]) if blobs else np.zeros(0, dtype=np.float32)
+    return pa.FixedSizeListArray.from_arrays(pa.array(flat, type=pa.float32()), VECTOR_DIM)
+
+
+def _export_table(db: RAGDB, table: str, schema: pa.Schema, path: str, batch_size: int, to_batch) -> int:
+    rows_written = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in db.iter_batches(table, schema.names, batch_size=batch_size):
+            writer.write_batch(to_batch(rows))
+            rows_written += len(rows)
+    return rows_written
+
+
+def export_snapshot(db: RAGDB, directory: str, batch_size: int = 1024) -> dict:
+    """
+    Writes resources and conversations (with their input vectors) to Parquet files in `directory`.
+
+    Rows are streamed with `RAGDB.iter_batches` and written one record batch at a time, so memory
+    use is bounded by `batch_size` rather than the size of the database.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    def resource_batch(rows):
+        columns = list(zip(*rows))
+        columns[0] = [str(rid) for rid in columns[0]]
+        return pa.RecordBatch.from_arrays(
+            [pa.array(col, type=field.type) for col, field in zip(columns, RESOURCES_SCHEMA)],
+            schema=RESOURCES_SCHEMA
+        )
+
+    def conversation_batch(rows):
+        columns = list(zip(*rows))
+        arrays = [pa.array(col, type=field.type) for col, field in zip(columns[:5], CONVERSATIONS_SCHEMA)]
+        arrays.append(_vector_array(columns[5], columns[1]))
+        return pa.RecordBatch.from_arrays(arrays, schema=CONVERSATIONS_SCHEMA)
+
+    resources = _export_table(
+        db, 'resources', RESOURCES_SCHEMA, os.path.join(directory, RESOURCES_FILE), batch_size, resource_batch
+    )
+    conversations = _export_table(
+        db, 'conversations', CONVERSATIONS_SCHEMA, os.path.join(directory, CONVERSATIONS_FILE), batch_size, conversation_batch
+    )
+
+    return {"resources": resources, "conversations": conversations}
+
+
+def _iter_batches(path: str, batch_size: int):
+    if not os.path.exists(path):
+        return
+    parquet_file = pq.ParquetFile(path)
+    # iter_batches fails on a file without row groups, i.e. an empty table
+    if parquet_file.metadata.num_rows == 0:
+        return
+    yield from parquet_file.iter_batches(batch_size=batch_size)
+
+
+def _same_tokenizer(path: str) -> bool:
+    # Snapshots from before the version was recorded count as another version
+    metadata = pq.ParquetFile(path).schema_arrow.metadata or {}
+    return metadata.get(b"tokenizer_version") == str(TOKENIZER_VERSION).encode()
+
+
+def import_snapshot(db: RAGDB, directory: str, batch_size: int = 1024) -> dict:
+    """
+    Bulk-loads a snapshot written by `export_snapshot` into `db`.
+
+    Everything is inserted inside a single transaction, so a failed import leaves the
+    database untouched. Rows get new ids; the snapshot ids are not preserved. Conversation
+    vectors written by another tokenizer version are dropped and recomputed.
+    """
+    counts = {"resources": 0, "conversations": 0}
+    resources_path = os.path.join(directory, RESOURCES_FILE)
+    conversations_path = os.path.join(directory, CONVERSATIONS_FILE)
+    stale_vectors = os.path.exists(conversations_path) and not _same_tokenizer(conversations_path)
+
+    with sqlite3.connect(db.db_path) as conn:
+        cursor = conn.cursor()
+
+        for batch in _iter_batches(resources_path, batch_size):
+            cols = batch.to_pydict()
+            cursor.executemany(
+                'INSERT INTO resources (name, description, content, created_at, tags, source, last_accessed, hit_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                zip(
+                    cols["name"], cols["description"], cols["content"], cols["created_at"], cols["tags"],
+                    cols["source"], cols["last_accessed"], cols["hit_count"]
+                )
+            )
+            counts["resources"] += batch.num_rows
+
+        for batch in _iter_batches(conversations_path, batch_size):
+            user_inputs = batch.column("user_input").to_pylist()
+            if stale_vectors:
+                # NULLs are filled in by the backfill below
+                normalized = [None] * batch.num_rows
+                vectors = [None] * batch.num_rows
+            else:
+                normalized = [n or normalize_text(u) for n, u in zip(batch.column("normalized_input").to_pylist(), user_inputs)]
+                vectors = [v.tobytes() for v in batch.column("input_vector").flatten().to_numpy().reshape(-1, VECTOR_DIM)]
+            cursor.executemany(
+                'INSERT INTO conversations (user_input, assistant_response, created_at, normalized_input, input_vector) VALUES (?, ?, ?, ?, ?)',
+                zip(
+                    user_inputs,
+                    batch.column("assistant_response").to_pylist(),
+                    batch.column("created_at").to_pylist(),
+                    normalized,
+                    vectors
+                )
+            )
+            counts["conversations"] += batch.num_rows
+
+    # Token cache rows are derived data and not part of the snapshot
+    db._backfill_resource_tokens()
+    if stale_vectors:
+        db._backfill_conversation_vectors()
+    return counts
+
+
+def load_conversation_vectors(directory: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns (ids, vectors) from a snapshot, with vectors as an (n, VECTOR_DIM) float32 matrix.
+
+    The matrix is a zero-copy view over the Arrow buffer when the file holds a single chunk.
+    """
+    table = pq.read_table(os.path.join(directory, CONVERSATIONS_FILE), columns=["id", "input_vector"])
+    ids = table.column("id").to_numpy()
+    vectors = table.column("input_vector").combine_chunks().flatten()
+    return ids, vectors.to_numpy(zero_copy_only=True).reshape(-1, VECTOR_DIM)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export or import a Parquet snapshot of the knowledge base.")
+    parser.add_argument("action", choices=["export", "import"])
+    parser.add_argument("directory")
+    parser.add_argument("--db", default="ragV2.db")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    args = parser.parse_args()
+
+    db = RAGDB(args.db)
+    if args.action == "export":
+        print(export_snapshot(db, args.directory, args.batch_size))
+    else:
+        print(import_snapshot(db, args.directory, args.batch_size))
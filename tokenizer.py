@@ -0,0 +1,113 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import List, FrozenSet
+
+# Bump when tokenisation changes, stored token caches and vectors are rebuilt on startup
+TOKENIZER_VERSION = 4
+
+_WORD_RE = re.compile(r"[^\W_]+")
+_TAG_SPLIT_RE = re.compile(r"[,;\n]+")
+# "don't" -> "do not", so the negation survives the word split
+_NEGATION_RE = re.compile(r"n['’]t\b")
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being below between
+both but by can could did do does doing down during each few for from further had has have having he her
+here hers herself him himself his how i if in into is it its itself just me more most my myself no nor not
+now of off on once only or other our ours ourselves out over own same she should so some such than that the
+their theirs them themselves then there these they this those through to too under until up very was we were
+what when where which while who whom why will with would you your yours yourself yourselves
+""".split())
+
+# Question words and negation. Stopwords for term matching, but they change what a
+# question asks, so the conversation vectors keep them
+INTENT_WORDS = frozenset("how why what when where which who whom not no nor never".split())
+
+
+def normalize(text: str) -> str:
+    """NFKD-decomposes, drops accents and casefolds, so 'Café' and 'cafe' compare equal."""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def words(text: str) -> List[str]:
+    """Normalised words, punctuation and underscores split words apart."""
+    return _WORD_RE.findall(normalize(text))
+
+
+_VOWELS = frozenset("aeiouy")
+
+
+def _strip_verb_suffix(word: str, suffix: str) -> str:
+    # The remaining stem needs four letters and a vowel, so "string", "spring" and
+    # "embed" keep their ending. A doubled final consonant is undone: "embedd" -> "embed"
+    base = word[:-len(suffix)]
+    if len(base) < 4 or not any(c in _VOWELS for c in base):
+        return word
+    if base[-1] == base[-2] and base[-1] not in _VOWELS and base[-1] not in "lsz":
+        return base[:-1]
+    return base
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """
+    Light suffix stripping: plurals first, then -ing and -ed on a long enough stem.
+    Short words are left alone.
+    """
+    if len(word) <= 3 or not word.isalpha():
+        return word
+    if word.endswith(("ies", "ied")) and len(word) > 4:
+        word = word[:-3] + "y"
+    elif word.endswith("sses"):
+        word = word[:-2]
+    elif word.endswith("s") and not word.endswith(("ss", "us", "is")):
+        word = word[:-1]
+    if word.endswith("ing"):
+        return _strip_verb_suffix(word, "ing")
+    if word.endswith("ed") and not word.endswith("eed"):
+        return _strip_verb_suffix(word, "ed")
+    return word
+
+
+def tokenize(text: str, keep_intent: bool = False) -> List[str]:
+    """
+    Normalised, stemmed words without stopwords or stray letters, in document order.
+    Digits are kept, and so are `INTENT_WORDS` when `keep_intent` is set.
+    """
+    keep = INTENT_WORDS if keep_intent else frozenset()
+    return [
+        stem(w) for w in words(_NEGATION_RE.sub(" not", text or ""))
+        if (w not in STOPWORDS or w in keep) and (len(w) > 1 or w.isdigit())
+    ]
+
+
+def term_set(text: str) -> FrozenSet[str]:
+    return frozenset(tokenize(text))
+
+
+@lru_cache(maxsize=4096)
+def query_terms(query: str) -> FrozenSet[str]:
+    """Cached `term_set` for queries, so a turn tokenises each query string once."""
+    return term_set(query)
+
+
+def split_tags(tags: str) -> List[str]:
+    """Comma separated tags as normalised phrases, with empty entries dropped."""
+    return [" ".join(words(t)) for t in _TAG_SPLIT_RE.split(tags or "") if words(t)]
+
+
+def tag_terms(tags: str) -> FrozenSet[str]:
+    return frozenset(t for tag in split_tags(tags) for t in tokenize(tag))
+
+
+if __name__ == "__main__":
+    # Singular, plural and verb forms have to share a stem
+    for forms in [("string", "strings"), ("apply", "applies", "applied"), ("family", "families"),
+                  ("spring", "springs"), ("speed", "speeds"), ("embed", "embedded", "embedding", "embeddings"),
+                  ("install", "installs", "installed", "installing"), ("run", "running"), ("class", "classes")]:
+        stems = {stem(w) for w in forms}
+        assert len(stems) == 1, f"{forms} -> {sorted(stems)}"
+    assert tokenize("Why shouldn't I install NumPy?", keep_intent=True) == ["why", "not", "install", "numpy"]
+    print("tokenizer ok")
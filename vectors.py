@@ -0,0 +1,41 @@
+import zlib
+import numpy as np
+from tokenizer import words, tokenize
+
+# Size of the hashed bag-of-words vectors stored next to conversations
+VECTOR_DIM = 256
+
+
+def normalize_text(text: str) -> str:
+    """Normalised words (accents stripped, casefolded) separated by single spaces."""
+    return " ".join(words(text))
+
+
+def embed_text(text: str, dim: int = VECTOR_DIM) -> np.ndarray:
+    """
+    Embeds text with the hashing trick over unigrams and bigrams of its tokens.
+    Question words and negation are kept, "how to X" and "why not X" must not collide.
+
+    Uses crc32 so the vectors are stable across processes. The result is L2
+    normalised, so the dot product of two vectors is their cosine similarity.
+    """
+    tokens = tokenize(text, keep_intent=True)
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+
+    vec = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        h = zlib.crc32(feature.encode("utf-8"))
+        vec[h % dim] += 1.0 if (h >> 31) & 1 else -1.0
+
+    norm = np.linalg.norm(vec)
+    if norm > 0:
+        vec /= norm
+    return vec
+
+
+def to_blob(vec: np.ndarray) -> bytes:
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def from_blob(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float32)
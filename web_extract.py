@@ -0,0 +1,104 @@
+import re
+import requests
+from lxml import etree
+from typing import Optional
+
+# Download at most this many bytes of a page
+PAGE_MAX_BYTES = 1024 * 1024
+# Stop parsing once this much text has been collected
+PAGE_MAX_CHARS = 4096
+
+CHUNK_SIZE = 16 * 1024
+
+# Elements whose text is kept, and elements that are dropped with everything inside them
+CONTENT_TAGS = {'p', 'h1', 'h2', 'h3', 'li', 'blockquote', 'pre'}
+SKIP_TAGS = {'script', 'style', 'nav', 'footer', 'header', 'noscript', 'aside', 'form'}
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+_WHITESPACE_RE = re.compile(r'\s+')
+_CHARSET_RE = re.compile(r'charset=["\']?([\w.:-]+)', re.IGNORECASE)
+_META_CHARSET_RE = re.compile(rb'<meta[^>]+charset=["\']?([\w.:-]+)', re.IGNORECASE)
+
+
+def _element_text(el) -> str:
+    etree.strip_elements(el, *SKIP_TAGS, with_tail=False)
+    return _WHITESPACE_RE.sub(' ', ' '.join(el.itertext())).strip()
+
+
+def _make_parser(charset: Optional[str], first_chunk: bytes):
+    # Header charset first, then a <meta charset> in the first chunk, then UTF-8
+    if not charset:
+        meta = _META_CHARSET_RE.search(first_chunk)
+        charset = meta.group(1).decode('ascii', 'ignore') if meta else 'utf-8'
+    try:
+        return etree.HTMLPullParser(events=('start', 'end'), encoding=charset)
+    except LookupError:
+        return etree.HTMLPullParser(events=('start', 'end'), encoding='utf-8')
+
+
+def fetch_page_text(url: str, headers: Optional[dict] = None, timeout: float = 10, max_bytes: int = PAGE_MAX_BYTES, max_chars: int = PAGE_MAX_CHARS) -> Optional[str]:
+    """
+    Streams a web page and extracts its main text with lxml's incremental HTML parser.
+
+    - Non-HTML responses are rejected from the Content-Type header before the body is read.
+    - At most `max_bytes` are downloaded.
+    - Parsing stops as soon as `max_chars` of text have been collected.
+
+    Returns None for non-HTML pages. Request errors are raised to the caller.
+    """
+    with requests.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+
+        content_type = response.headers.get('Content-Type', '')
+        if content_type and not content_type.lower().startswith(HTML_CONTENT_TYPES):
+            return None
+
+        header_charset = _CHARSET_RE.search(content_type)
+        parser = None
+        pieces = []
+        collected = 0
+        received = 0
+        skip_depth = 0
+        content_depth = 0
+
+        def consume():
+            nonlocal collected, skip_depth, content_depth
+            for event, el in parser.read_events():
+                tag = el.tag.lower() if isinstance(el.tag, str) else ''
+                if event == 'start':
+                    if tag in SKIP_TAGS:
+                        skip_depth += 1
+                    elif tag in CONTENT_TAGS:
+                        content_depth += 1
+                    continue
+
+                if tag in SKIP_TAGS:
+                    skip_depth -= 1
+                elif tag in CONTENT_TAGS:
+                    content_depth -= 1
+                    # Only the outermost content element is collected, nested ones are part of it
+                    if content_depth == 0 and skip_depth == 0:
+                        text = _element_text(el)
+                        if text:
+                            pieces.append(text)
+                            collected += len(text) + 1
+
+                # Release finished subtrees, unless an enclosing content element still needs them
+                if content_depth == 0:
+                    el.clear()
+
+        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+            received += len(chunk)
+            if parser is None:
+                parser = _make_parser(header_charset.group(1) if header_charset else None, chunk)
+            parser.feed(chunk)
+            consume()
+            if collected >= max_chars or received >= max_bytes:
+                break
+        else:
+            if parser is not None:
+                parser.close()
+                consume()
+
+    return ' '.join(pieces)[:max_chars]